@@ -6,39 +6,253 @@
 """
 import time
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
 import datetime
 import os
 import json
-from typing import Dict, Any, List, Optional, Literal, cast
+import random
+import traceback
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType, SimpleNamespace
+from collections import deque
+from itertools import islice
+from typing import Dict, Any, List, Optional, Set, Tuple, Literal, cast
 import pytz
 
 import ccxt
-import pandas as pd
 import numpy as np
 import math
 
+# 可选：orjson 更快的JSON编解码，未安装时回退标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选：ccxt.pro WebSocket（ccxt>=4 自带），用于K线推送；不可用时仅走REST
+try:
+    import ccxt.pro as ccxtpro
+except ImportError:
+    ccxtpro = None
+
+# 可选：numba JIT 加速指标递推，未安装时回退为普通Python函数
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+def _json_dumps(obj: Any) -> bytes:
+    """紧凑JSON序列化（优先orjson）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# 日志时间格式（模块级常量）
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+# 北京时区（模块级常量，避免每次调用重复查找时区）
+CHINA_TZ = pytz.timezone('Asia/Shanghai')
+
 # 配置日志 - 使用中国时区和UTF-8编码
 class ChinaTimeFormatter(logging.Formatter):
     """中国时区的日志格式化器"""
+    _TZ = CHINA_TZ
+
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(fmt, datefmt)
+        self._datefmt = datefmt or LOG_DATEFMT
+
     def formatTime(self, record, datefmt=None):
-        dt = datetime.datetime.fromtimestamp(record.created, tz=pytz.timezone('Asia/Shanghai'))
-        if datefmt:
-            s = dt.strftime(datefmt)
-        else:
-            s = dt.strftime('%Y-%m-%d %H:%M:%S')
-        return s
+        return datetime.datetime.fromtimestamp(record.created, tz=self._TZ).strftime(self._datefmt)
 
 # 配置日志 - 确保RAILWAY平台兼容
 handler = logging.StreamHandler()
 handler.setLevel(logging.INFO)
-formatter = ChinaTimeFormatter('%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+formatter = ChinaTimeFormatter('%(asctime)s [%(levelname)s] %(message)s', datefmt=LOG_DATEFMT)
 handler.setFormatter(formatter)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-logger.addHandler(handler)
+# 日志经队列交给后台线程格式化与输出，调用方入队即返回，不在交易路径上争抢 stdout 锁
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # 退出前排空队列
 logger.propagate = False  # 防止重复日志
 
+# === 指标计算内核（numba 可用时编译为机器码） ===
+@njit(cache=True, fastmath=True)
+def _macd_kernel(prices, f, s, si):
+    """单次遍历计算 MACD(f,s,si)，返回最新 (macd, signal, histogram)；EMA 同 pandas ewm(span, adjust=False)"""
+    alpha_f = 2.0 / (f + 1)
+    alpha_s = 2.0 / (s + 1)
+    alpha_si = 2.0 / (si + 1)
+    ema_f = prices[0]
+    ema_s = prices[0]
+    sig = 0.0
+    for i in range(1, prices.shape[0]):
+        x = prices[i]
+        ema_f = (1.0 - alpha_f) * ema_f + alpha_f * x
+        ema_s = (1.0 - alpha_s) * ema_s + alpha_s * x
+        sig = (1.0 - alpha_si) * sig + alpha_si * (ema_f - ema_s)
+    macd = ema_f - ema_s
+    return macd, sig, macd - sig
+
+@njit(cache=True, fastmath=True)
+def _macd_lines_kernel(prices, f, s, si):
+    """单次遍历输出完整 (macd_line, signal_line)，递推与 _macd_kernel 相同"""
+    n = prices.shape[0]
+    macd_line = np.empty(n)
+    signal_line = np.empty(n)
+    alpha_f = 2.0 / (f + 1)
+    alpha_s = 2.0 / (s + 1)
+    alpha_si = 2.0 / (si + 1)
+    ema_f = prices[0]
+    ema_s = prices[0]
+    sig = 0.0
+    macd_line[0] = 0.0
+    signal_line[0] = 0.0
+    for i in range(1, n):
+        x = prices[i]
+        ema_f = (1.0 - alpha_f) * ema_f + alpha_f * x
+        ema_s = (1.0 - alpha_s) * ema_s + alpha_s * x
+        sig = (1.0 - alpha_si) * sig + alpha_si * (ema_f - ema_s)
+        macd_line[i] = ema_f - ema_s
+        signal_line[i] = sig
+    return macd_line, signal_line
+
+@njit(cache=True, fastmath=True)
+def _macd_prev_state_kernel(prices, alpha_f, alpha_s, alpha_si):
+    """递推到倒数第二个价格（即前一根K线）为止，返回 EMA 状态 (ema_fast, ema_slow, signal)；
+    等价于对 prices[:-1] 做 MACD 递推，最新一根由调用方在此状态上再走一步；alpha 由调用方预先算好"""
+    ema_f = prices[0]
+    ema_s = prices[0]
+    sig = 0.0
+    for i in range(1, prices.shape[0] - 1):
+        x = prices[i]
+        ema_f = (1.0 - alpha_f) * ema_f + alpha_f * x
+        ema_s = (1.0 - alpha_s) * ema_s + alpha_s * x
+        sig = (1.0 - alpha_si) * sig + alpha_si * (ema_f - ema_s)
+    return ema_f, ema_s, sig
+
+@njit(cache=True, fastmath=True)
+def _atr_kernel(highs, lows, closes, period):
+    """单次遍历计算 ATR（Wilder）：TR 逐根现算不落数组，前period根均值作为首个ATR，再递推，返回最新ATR"""
+    atr = 0.0
+    for i in range(highs.shape[0]):
+        # TR：首根为 high-low，其余取与前收盘的最大波幅
+        if i == 0:
+            tr = highs[0] - lows[0]
+        else:
+            tr = max(highs[i] - lows[i], abs(highs[i] - closes[i - 1]), abs(lows[i] - closes[i - 1]))
+        if i < period:
+            atr += tr
+            if i == period - 1:
+                atr = atr / period
+        else:
+            atr = (atr * (period - 1) + tr) / period
+    return atr
+
+@njit(cache=True, fastmath=True)
+def _adx_state_kernel(highs, lows, closes, period):
+    """ADX 递推主体：返回末根的平滑状态 (plus_sm, minus_sm, tr_sm, adx)，供调用方缓存后再逐根递推"""
+    n = highs.shape[0]
+    plus_sm = 0.0
+    minus_sm = 0.0
+    tr_sm = 0.0
+    adx = 0.0
+    for j in range(n - 1):
+        i = j + 1
+        up_move = highs[i] - highs[i - 1]
+        down_move = lows[i - 1] - lows[i]
+        plus_dm = up_move if (up_move > down_move and up_move > 0) else 0.0
+        minus_dm = down_move if (down_move > up_move and down_move > 0) else 0.0
+        tr = max(highs[i] - lows[i], abs(highs[i] - closes[i - 1]), abs(lows[i] - closes[i - 1]))
+        if j < period:
+            # 前period根求和作为平滑初值；此前的DX视为0
+            plus_sm += plus_dm
+            minus_sm += minus_dm
+            tr_sm += tr
+            if j < period - 1:
+                continue
+        else:
+            plus_sm = plus_sm - plus_sm / period + plus_dm
+            minus_sm = minus_sm - minus_sm / period + minus_dm
+            tr_sm = tr_sm - tr_sm / period + tr
+        tr_safe = tr_sm if tr_sm != 0 else 1e-12
+        plus_di = 100.0 * plus_sm / tr_safe
+        minus_di = 100.0 * minus_sm / tr_safe
+        dx = 100.0 * abs(plus_di - minus_di) / max(plus_di + minus_di, 1e-12)
+        if j == period - 1:
+            adx = dx / period
+        else:
+            adx = (adx * (period - 1) + dx) / period
+    return plus_sm, minus_sm, tr_sm, adx
+
+@njit(cache=True, fastmath=True)
+def _adx_kernel(highs, lows, closes, period):
+    """单次遍历计算 ADX：+DM/-DM/TR 三路 Wilder 平滑与 DX→ADX 递推融合，返回最新ADX"""
+    return _adx_state_kernel(highs, lows, closes, period)[3]
+
+@njit(cache=True)
+def _trailing_long(sl, entry, peak_in, basis, n, atr, trigger_pct, trail_pct):
+    """多头移动止损：返回 (new_sl, new_peak)；SL=max(SL_old, basis-N*ATR, peak*(1-trail_pct))"""
+    peak = max(peak_in, basis)
+    atr_sl = basis - n * atr
+    # 激活条件：涨幅达到 trigger_pct
+    percent_sl = peak * (1 - trail_pct) if basis >= entry * (1 + trigger_pct) else sl
+    return max(sl, atr_sl, percent_sl), peak
+
+@njit(cache=True)
+def _trailing_short(sl, entry, trough_in, basis, n, atr, trigger_pct, trail_pct):
+    """空头移动止损：返回 (new_sl, new_trough)；SL=min(SL_old, basis+N*ATR, trough*(1+trail_pct))"""
+    trough = min(trough_in, basis) if trough_in != 0.0 else basis
+    atr_sl = basis + n * atr
+    # 激活条件：跌幅达到 trigger_pct（相对入场价下跌）
+    percent_sl = trough * (1 + trail_pct) if basis <= entry * (1 - trigger_pct) else sl
+    return min(sl, atr_sl, percent_sl), trough
+
+def _warmup_kernels():
+    """启动时用小数组预调用各JIT内核：命中 cache=True 的磁盘缓存或提前完成编译，避免首个交易tick承担编译延迟"""
+    arr = np.linspace(1.0, 2.0, 32)
+    _macd_kernel(arr, 12, 26, 9)
+    _macd_prev_state_kernel(arr, 2.0 / 13, 2.0 / 27, 2.0 / 10)
+    _atr_kernel(arr + 0.1, arr - 0.1, arr, 14)
+    _adx_kernel(arr + 0.1, arr - 0.1, arr, 14)
+    _trailing_long(1.0, 1.0, 1.0, 1.0, 2.0, 0.1, 0.01, 0.01)
+    _trailing_short(1.0, 1.0, 1.0, 1.0, 2.0, 0.1, 0.01, 0.01)
+
+def _build_signal_table() -> List[Tuple[str, str]]:
+    """预生成信号表：下标 = 持仓状态(0无/1多/2空)<<6 | 金叉 | 柱转正<<1 | 死叉<<2 | 柱转负<<3 | 柱>0<<4 | 柱<0<<5"""
+    table = []
+    for code in range(3 << 6):
+        state = code >> 6
+        buy_cross, buy_color, sell_cross, sell_color, hist_pos, hist_neg = ((code >> b) & 1 for b in range(6))
+        if state == 0:
+            # 双确认开仓：交叉 + 柱状图跨零变色（减少频繁交易）
+            if buy_cross and buy_color:
+                table.append(('buy', '双确认：金叉 + 柱状图由负转正'))
+            elif sell_cross and sell_color:
+                table.append(('sell', '双确认：死叉 + 柱状图由正转负'))
+            else:
+                table.append(('hold', '等待双确认信号'))
+        elif state == 1:
+            # 多头双确认平仓：死叉且柱状图为负
+            table.append(('close', '多头双确认平仓：死叉且柱状图为负') if sell_cross and hist_neg else ('hold', '持有多头'))
+        else:
+            # 空头双确认平仓：金叉且柱状图为正
+            table.append(('close', '空头双确认平仓：金叉且柱状图为正') if buy_cross and hist_pos else ('hold', '持有空头'))
+    return table
+
+SIGNAL_TABLE: List[Tuple[str, str]] = _build_signal_table()
+
 class TradingStats:
     """交易统计类"""
     def __init__(self, stats_file: str = 'trading_stats.json'):
@@ -53,6 +267,10 @@ class TradingStats:
             'trades_history': []
         }
         self.load_stats()
+        # 交易历史使用有界队列，只保留最近100条记录
+        self.stats['trades_history'] = deque(self.stats.get('trades_history') or [], maxlen=100)
+        # 平仓可能在I/O线程池中并发完成，统计累加与落盘需串行
+        self._lock = threading.Lock()
     
     def load_stats(self):
         """加载统计数据"""
@@ -65,15 +283,23 @@ class TradingStats:
             logger.warning(f"⚠️ 加载统计数据失败: {e}，使用新数据")
     
     def save_stats(self):
-        """保存统计数据"""
+        """保存统计数据：先写临时文件并落盘，再原子替换，进程中途退出也不会留下半截文件"""
         try:
-            with open(self.stats_file, 'w') as f:
-                json.dump(self.stats, f, indent=2)
+            tmp_file = self.stats_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(_json_dumps({**self.stats, 'trades_history': list(self.stats['trades_history'])}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.stats_file)
         except Exception as e:
             logger.error(f"❌ 保存统计数据失败: {e}")
     
     def add_trade(self, symbol: str, side: str, pnl: float):
-        """添加交易记录"""
+        """添加交易记录（线程安全）"""
+        with self._lock:
+            self._add_trade(symbol, side, pnl)
+
+    def _add_trade(self, symbol: str, side: str, pnl: float):
         self.stats['total_trades'] += 1
         self.stats['total_pnl'] += pnl
         
@@ -85,19 +311,14 @@ class TradingStats:
             self.stats['total_loss_pnl'] += pnl
         
         # 添加交易历史 - 使用北京时间
-        china_tz = pytz.timezone('Asia/Shanghai')
         trade_record = {
-            'timestamp': datetime.datetime.now(china_tz).strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp': datetime.datetime.now(CHINA_TZ).strftime(LOG_DATEFMT),
             'symbol': symbol,
             'side': side,
             'pnl': round(pnl, 4)
         }
         self.stats['trades_history'].append(trade_record)
         
-        # 只保留最近100条记录
-        if len(self.stats['trades_history']) > 100:
-            self.stats['trades_history'] = self.stats['trades_history'][-100:]
-        
         self.save_stats()
     
     def get_win_rate(self) -> float:
@@ -131,16 +352,36 @@ class MACDStrategy:
             }
         })
         
+        # ccxt 同步客户端的限速器读写 lastRestRequestTimestamp 时不加锁，I/O线程池并发请求会一起越过限速；
+        # 用锁把限速等待与时间戳更新串行化（只锁限速这一步，请求本身仍并发）
+        self._rest_lock = threading.Lock()
+        self._install_throttle_lock()
+
         # OKX统一参数（强制使用SWAP场景）
         self.okx_params = {'instType': 'SWAP'}
+        # 方向映射：下单方向 -> 持仓方向；持仓方向 -> 平仓方向
+        self._pos_side_of = {'buy': 'long', 'sell': 'short'}
+        self._close_side_of = {'long': 'sell', 'short': 'buy'}
+        # 下单参数模板（只读，调用处不得修改）：(posSide, reduceOnly) -> params
+        self._params_templates: Dict[Tuple[str, bool], Dict[str, Any]] = {
+            ('long', False): {'tdMode': 'cross', 'posSide': 'long'},
+            ('short', False): {'tdMode': 'cross', 'posSide': 'short'},
+            ('long', True): {'reduceOnly': True, 'posSide': 'long', 'tdMode': 'cross'},
+            ('short', True): {'reduceOnly': True, 'posSide': 'short', 'tdMode': 'cross'},
+        }
 
-        # 将统一交易对转为OKX instId，例如 FIL/USDT:USDT -> FIL-USDT-SWAP
+        # 将统一交易对转为OKX instId，例如 FIL/USDT:USDT -> FIL-USDT-SWAP（映射固定，结果按symbol缓存）
+        self._inst_id_cache: Dict[str, str] = {}
         def _symbol_to_inst_id(sym: str) -> str:
-            try:
-                base = sym.split('/')[0]
-                return f"{base}-USDT-SWAP"
-            except Exception:
-                return ''
+            inst_id = self._inst_id_cache.get(sym)
+            if inst_id is None:
+                try:
+                    base = sym.split('/')[0]
+                    inst_id = f"{base}-USDT-SWAP"
+                except Exception:
+                    inst_id = ''
+                self._inst_id_cache[sym] = inst_id
+            return inst_id
         self.symbol_to_inst_id = _symbol_to_inst_id
         
         # 交易对配置 - 小币种
@@ -153,6 +394,8 @@ class MACDStrategy:
         
         # 时间周期 - 15分钟
         self.timeframe = '15m'
+        # 周期秒数（如 15m→900、1H→3600），用于判断当前K线周期
+        self._tf_seconds: int = int(self.timeframe[:-1]) * {'m': 60, 'H': 3600, 'h': 3600, 'D': 86400, 'd': 86400, 'W': 604800}[self.timeframe[-1]]
         
         # MACD参数
         self.fast_period = 10
@@ -174,24 +417,76 @@ class MACDStrategy:
             'WIF/USDT:USDT': {'macd': (9, 30, 12), 'atr_period': 14, 'adx_period': 10, 'adx_min_trend': 30, 'sl_n': 2.5, 'tp_m': 2.8, 'allow_reverse': False},
             'WLD/USDT:USDT': {'macd': (10, 40, 15), 'atr_period': 14, 'adx_period': 14, 'adx_min_trend': 25, 'sl_n': 2.0, 'tp_m': 3.5, 'allow_reverse': True},
         }
+        # 分币种参数展平（启动时解析一次）：macd=(f,s,si)，adx_min=硬过滤阈值(0为不过滤)，allow_reverse=平仓是否反手
+        self._sym_cfg: Dict[str, SimpleNamespace] = {}
+        # MACD 平滑系数缓存：(f, s, si) -> (2/(f+1), 2/(s+1), 2/(si+1))
+        self._macd_alphas: Dict[Tuple[int, int, int], Tuple[float, float, float]] = {}
+        # 前一根K线的MACD递推状态缓存：symbol -> ((bar_key, (f,s,si)), (ema_fast, ema_slow, signal))
+        self._macd_state: Dict[str, Tuple[Any, Tuple[float, float, float]]] = {}
+        # 前一根K线的ATR递推状态缓存：symbol -> ((bar_key, period), (atr_prev, prev_close))
+        self._atr_state: Dict[str, Tuple[Any, Tuple[float, float]]] = {}
+        # 前一根K线的ADX递推状态缓存：symbol -> ((bar_key, period), (plus_sm, minus_sm, tr_sm, adx, prev_high, prev_low, prev_close))
+        self._adx_state: Dict[str, Tuple[Any, Tuple[float, ...]]] = {}
+        for symbol in self.symbols:
+            _p = self.per_symbol_params.get(symbol, {})
+            _macd = _p.get('macd')
+            self._sym_cfg[symbol] = SimpleNamespace(
+                macd=tuple(int(x) for x in _macd) if isinstance(_macd, tuple) and len(_macd) == 3 else (self.fast_period, self.slow_period, self.signal_period),
+                adx_min=float(_p.get('adx_min_trend', 0) or 0),
+                allow_reverse=bool(_p.get('allow_reverse', True)),
+            )
         
         # 仓位配置 - 使用100%资金
         self.position_percentage = 1.0
         
         # 持仓和挂单缓存
         self.positions_cache: Dict[str, Dict[str, Any]] = {}
+        self._position_cache_ts: Dict[str, float] = {}  # symbol -> 持仓缓存写入时间
         self.open_orders_cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._open_orders_cache_ts: Dict[str, float] = {}  # symbol -> 挂单缓存写入时间
+        self._open_orders_ttl: float = 5.0  # 挂单缓存有效期（秒）
+        self._open_orders_known: Set[str] = set()  # 可能存在挂单的交易对（自身刚下单或查询到挂单），需走接口确认
         self.last_sync_time: float = 0
         self.sync_interval: int = 60  # 60秒同步一次状态
         
         # 市场信息缓存
         self.markets_info: Dict[str, Dict[str, Any]] = {}
+        # 最近一次K线的SoA数组：symbol -> {'high','low','close'}（float64 连续数组，按时间升序）
+        self.klines_soa: Dict[str, Dict[str, np.ndarray]] = {}
+        # 单轮K线复用：symbol -> (tick_id, klines, soa)；_tick_id 仅在 execute_strategy 执行期间非0
+        self._tick_id: int = 0
+        self._tick_positions_fresh: bool = False  # 本轮是否已批量刷新持仓缓存
+        self._klines_memo: Dict[str, Tuple[int, List[Dict], Dict[str, np.ndarray]]] = {}
+        # 最新价缓存：instId -> (last_price, ts)，由批量 tickers 接口统一刷新
+        self._ticker_cache: Dict[str, Tuple[float, float]] = {}
+        self._ticker_ttl: float = 0.5
+        # 账户余额缓存：(USDT可用余额, monotonic时间)，下单成功即作废
+        self._balance_cache: Optional[Tuple[float, float]] = None
+        self._balance_ttl: float = 3.0
+        # WebSocket K线缓冲：symbol -> deque([ts, o, h, l, c, vol])，由后台线程单连接订阅全部币种并合并推送
+        self._ws_klines: Dict[str, deque] = {}
+        self._ws_kline_ts: Dict[str, float] = {}  # symbol -> 最近一次推送时间
+        self._ws_lock = threading.Lock()
+        self._ws_thread: Optional[threading.Thread] = None
+        # 新K线事件：WebSocket 推送出新一根K线时置位，主循环休眠期间被提前唤醒，无需等满整个间隔
+        self._new_bar_event = threading.Event()
+        # 跨轮次共享的有界I/O线程池：各币种K线/持仓/挂单的阻塞REST请求并发执行，避免每轮重建线程
+        self._io_pool = ThreadPoolExecutor(max_workers=min(8, len(self.symbols)) or 1, thread_name_prefix='io')
+        self._ws_stale_sec: float = 30.0  # 超过该时长无推送则回退REST
+        # REST K线窗口缓存：symbol -> 升序 [ts, o, h, l, c, vol] 数组，同一K线周期内只增量刷新最新一根
+        self._rest_klines: Dict[str, np.ndarray] = {}
+        self.use_ws_klines: bool = ccxtpro is not None and (os.environ.get('USE_WS_KLINES', '1').strip().lower() not in ('0', 'false', 'no'))
         # API 速率限制（节流器）：默认最小间隔 0.2s，可用 OKX_API_MIN_INTERVAL 覆盖
         self._last_api_ts: float = 0.0
         try:
             self._min_api_interval: float = float((os.environ.get('OKX_API_MIN_INTERVAL') or '0.2').strip())
         except Exception:
             self._min_api_interval = 0.2
+        # 令牌桶：平均速率 1/_min_api_interval，允许最多 _api_burst 次突发
+        self._api_burst: float = 5.0
+        self._api_tokens: float = self._api_burst
+        self._api_rate: float = 1.0 / self._min_api_interval if self._min_api_interval > 0 else 0.0
+        self._api_lock = threading.Lock()  # 补充/扣减令牌需原子完成（REST 请求来自多个I/O线程）
         
         # 交易统计
         self.stats = TradingStats()
@@ -205,10 +500,29 @@ class MACDStrategy:
             self.atr_tp_m = float((os.environ.get('ATR_TP_M') or '3.0').strip())
         except Exception:
             self.atr_tp_m = 3.0
+        # ATR/ADX 过滤参数（进程内常量，启动时解析一次）
+        try:
+            self.atr_period = int((os.environ.get('ATR_PERIOD') or '14').strip())
+        except Exception:
+            self.atr_period = 14
+        try:
+            self.atr_ratio_thresh = float((os.environ.get('ATR_RATIO_THRESH') or '0.004').strip())
+        except Exception:
+            self.atr_ratio_thresh = 0.004
+        try:
+            self.adx_period = int((os.environ.get('ADX_PERIOD') or '14').strip())
+        except Exception:
+            self.adx_period = 14
+        try:
+            self.adx_min_trend = float((os.environ.get('ADX_MIN_TREND') or '25').strip())
+        except Exception:
+            self.adx_min_trend = 25.0
         # SL/TP 状态缓存：symbol -> {'sl': float, 'tp': float, 'side': 1/-1, 'entry': float}
         self.sl_tp_state: Dict[str, Dict[str, float]] = {}
         # 交易所侧TP/SL已挂标记：symbol -> bool
         self.okx_tp_sl_placed: Dict[str, bool] = {}
+        # 交易所侧实际挂出的触发价：symbol -> (sl_trigger, tp_trigger)（已钳制并按 tick 对齐）
+        self._placed_tp_sl: Dict[str, Tuple[float, float]] = {}
         # 每币种参数配置（硬编码）
         self.symbol_cfg: Dict[str, Dict[str, float | str]] = {
             "ZRO/USDT:USDT": {"period": 14, "n": 1.8, "m": 2.6, "trigger_pct": 0.008, "trail_pct": 0.005, "update_basis": "high"},
@@ -216,6 +530,8 @@ class MACDStrategy:
             "WLD/USDT:USDT": {"period": 20, "n": 2.0, "m": 3.0, "trigger_pct": 0.010, "trail_pct": 0.006, "update_basis": "close"},
             "FIL/USDT:USDT": {"period": 20, "n": 2.2, "m": 3.5, "trigger_pct": 0.010, "trail_pct": 0.006, "update_basis": "high"},
         }
+        # 未配置币种的默认参数（只读共享，避免每次调用重新构造）
+        self._default_cfg: Dict[str, float | str] = {"period": 20, "n": 2.0, "m": 3.0, "trigger_pct": 0.010, "trail_pct": 0.006, "update_basis": "close"}
         # 跟踪峰值/谷值（用于动态止损）
         self.trailing_peak: Dict[str, float] = {}   # long使用：记录最高价
         self.trailing_trough: Dict[str, float] = {} # short使用：记录最低价
@@ -252,6 +568,10 @@ class MACDStrategy:
                 self.exchange.options = opts
             except Exception:
                 pass
+            # 可选：用 orjson 解析交易所响应
+            self._install_fast_json()
+            # HTTP 连接池扩容：并发请求复用长连接，不因池满丢弃连接再重新握手
+            self._tune_http_pool()
             logger.info("✅ API连接验证成功")
             
             # 同步交易所时间
@@ -294,6 +614,79 @@ class MACDStrategy:
             logger.error(f"❌ 交易所设置失败: {e}")
             raise
     
+    def _install_fast_json(self, exchange: Any = None):
+        """若安装了 orjson，则将 ccxt 响应解析替换为 orjson.loads；非JSON响应回退原实现。
+        OKX v5 的数值字段均以字符串返回，解析结果与标准库一致；请求体签名依赖 str，故不替换序列化。
+        exchange 默认为主 REST 客户端，也可传入 ccxt.pro 实例（其 load_markets 等 REST 请求同样受益）"""
+        if orjson is None:
+            return
+        exchange = exchange or self.exchange
+        fallback = exchange.parse_json
+
+        def _parse_json(http_response):
+            try:
+                return orjson.loads(http_response)
+            except orjson.JSONDecodeError:
+                return fallback(http_response)
+
+        exchange.parse_json = _parse_json
+        logger.info("✅ 已启用 orjson 解析交易所响应（%s）", type(exchange).__module__)
+
+    @staticmethod
+    def _install_fast_ws_json():
+        """若安装了 orjson，则将 ccxt.pro WebSocket 帧解码替换为 orjson.loads。
+        WS 帧由 aiohttp_client 模块内的 json.loads 解码（不经过实例的 parse_json），故替换该模块引用的 json：
+        以标准库 json 为底复制一份，仅覆盖 loads，解析失败回退标准库；dumps 等其余接口保持不变"""
+        if orjson is None:
+            return
+        try:
+            from ccxt.async_support.base.ws import aiohttp_client
+        except ImportError:
+            return
+        if getattr(aiohttp_client.json, '_orjson_shim', False):
+            return
+
+        def _loads(data, *args, **kwargs):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                return json.loads(data, *args, **kwargs)
+
+        shim = ModuleType('json')
+        shim.__dict__.update(json.__dict__)
+        shim.loads = _loads
+        shim._orjson_shim = True
+        aiohttp_client.json = shim
+        logger.info("✅ 已启用 orjson 解析WebSocket推送帧")
+
+    def _install_throttle_lock(self):
+        """包装 exchange.throttle：持锁完成限速等待并记录本次请求时间，供 fetch2 之后的并发调用者据此排队；
+        每次 REST 请求前先经过账户级令牌桶 _throttle"""
+        exchange = self.exchange
+        throttle = exchange.throttle
+
+        def _locked_throttle(cost=None):
+            with self._rest_lock:
+                self._throttle()
+                throttle(cost)
+                exchange.lastRestRequestTimestamp = exchange.milliseconds()
+
+        exchange.throttle = _locked_throttle
+
+    def _tune_http_pool(self, size: int = 16):
+        """为 ccxt 同步客户端的 requests.Session 挂载更大的连接池；默认池仅10个连接，
+        I/O线程池并发请求时超出部分用完即关，下次请求需重新 TCP/TLS 握手"""
+        session = getattr(self.exchange, 'session', None)
+        if session is None or not hasattr(session, 'mount'):
+            return
+        try:
+            from requests.adapters import HTTPAdapter
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        except Exception as e:
+            logger.debug("HTTP连接池调整失败: %s", e)
+
     def _load_markets(self):
         """加载市场信息（获取最小下单量等限制）"""
         try:
@@ -312,7 +705,8 @@ class MACDStrategy:
                 # 解析规格
                 min_sz = float(it.get('minSz') or 0) or 0.000001
                 lot_sz = float(it.get('lotSz') or 0) or None
-                tick_sz = float(it.get('tickSz') or 0) or 0.0001
+                tick_raw = float(it.get('tickSz') or 0)
+                tick_sz = tick_raw or 0.0001
                 amt_prec = len(str(lot_sz).split('.')[-1]) if lot_sz and '.' in str(lot_sz) else 8
                 px_prec = len(str(tick_sz).split('.')[-1]) if '.' in str(tick_sz) else 4
                 self.markets_info[symbol] = {
@@ -321,8 +715,11 @@ class MACDStrategy:
                     'amount_precision': amt_prec,
                     'price_precision': px_prec,
                     'lot_size': lot_sz,
+                    'amount_scale': self._pow10_scale(lot_sz),
+                    # 以交易所 tickSz 为准（可能不是10的幂，如 0.005）；缺失时才按价格精度推算
+                    'tick': tick_raw if tick_raw > 0 else 1.0 / 10 ** px_prec,
                 }
-                logger.info(f"📊 {symbol} - 最小数量:{min_sz:.8f} 步进:{(lot_sz or 0):.8f} Tick:{tick_sz:.8f}")
+                logger.info("📊 %s - 最小数量:%.8f 步进:%.8f Tick:%.8f", symbol, min_sz, lot_sz or 0, tick_sz)
             logger.info("✅ 市场信息加载完成")
         except Exception as e:
             logger.error(f"❌ 加载市场信息失败: {e}")
@@ -334,7 +731,19 @@ class MACDStrategy:
                     'amount_precision': 8,
                     'price_precision': 4,
                     'lot_size': None,
+                    'amount_scale': None,
+                    'tick': 1.0 / 10 ** 4,
                 }
+
+    @staticmethod
+    def _pow10_scale(step: Optional[float]) -> Optional[int]:
+        """若步进为10的非正整数次幂（如 1、0.1、0.01），返回整数倍率 1/step，用于整数域对齐；否则返回None"""
+        if not step or step <= 0:
+            return None
+        k = round(-math.log10(step))
+        if k < 0 or abs(step * 10 ** k - 1) > 1e-9:
+            return None
+        return 10 ** k
     
     def sync_exchange_time(self):
         """同步交易所时间 - 使用中国时区"""
@@ -344,9 +753,8 @@ class MACDStrategy:
             time_diff = server_time - local_time
             
             # 转换为中国时区
-            china_tz = pytz.timezone('Asia/Shanghai')
-            server_dt = datetime.datetime.fromtimestamp(server_time / 1000, tz=china_tz)
-            local_dt = datetime.datetime.fromtimestamp(local_time / 1000, tz=china_tz)
+            server_dt = datetime.datetime.fromtimestamp(server_time / 1000, tz=CHINA_TZ)
+            local_dt = datetime.datetime.fromtimestamp(local_time / 1000, tz=CHINA_TZ)
             
             logger.info(f"🕐 交易所时间: {server_dt.strftime('%Y-%m-%d %H:%M:%S')} (北京时间)")
             logger.info(f"🕐 本地时间: {local_dt.strftime('%Y-%m-%d %H:%M:%S')} (北京时间)")
@@ -367,18 +775,49 @@ class MACDStrategy:
             inst_id = self.symbol_to_inst_id(symbol)
             resp = self.exchange.privateGetTradeOrdersPending({'instType': 'SWAP', 'instId': inst_id})
             data = resp.get('data') if isinstance(resp, dict) else resp
-            results = []
-            for o in (data or []):
-                results.append({
-                    'id': o.get('ordId') or o.get('clOrdId'),
-                    'side': 'buy' if o.get('side') == 'buy' else 'sell',
-                    'amount': float(o.get('sz') or 0),
-                    'price': float(o.get('px') or 0) if o.get('px') else None,
-                })
-            return results
+            orders = [self._parse_order(o) for o in (data or [])]
+            self._store_open_orders(symbol, orders, time.time())
+            return orders
         except Exception as e:
             logger.error(f"❌ 获取{symbol}挂单失败: {e}")
+            # 状态未知：作废缓存，下次检查必须走接口
+            self._open_orders_cache_ts.pop(symbol, None)
             return []
+
+    def _store_open_orders(self, symbol: str, orders: List[Dict[str, Any]], ts: float):
+        """写入挂单缓存并维护 _open_orders_known"""
+        self.open_orders_cache[symbol] = orders
+        self._open_orders_cache_ts[symbol] = ts
+        if orders:
+            self._open_orders_known.add(symbol)
+        else:
+            self._open_orders_known.discard(symbol)
+
+    def _parse_order(self, o: Dict[str, Any]) -> Dict[str, Any]:
+        """将OKX原生挂单转换为内部结构"""
+        return {
+            'id': o.get('ordId') or o.get('clOrdId'),
+            'side': 'buy' if o.get('side') == 'buy' else 'sell',
+            'amount': float(o.get('sz') or 0),
+            'price': float(o.get('px') or 0) if o.get('px') else None,
+        }
+
+    def fetch_all_open_orders(self) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """一次请求获取全部SWAP挂单（不传instId），按交易对分组；失败返回None"""
+        try:
+            resp = self.exchange.privateGetTradeOrdersPending({'instType': 'SWAP'})
+            data = resp.get('data') if isinstance(resp, dict) else resp
+            by_inst: Dict[str, List[Dict[str, Any]]] = {}
+            for o in (data or []):
+                by_inst.setdefault(o.get('instId'), []).append(self._parse_order(o))
+            now = time.time()
+            result = {symbol: by_inst.get(self.symbol_to_inst_id(symbol), []) for symbol in self.symbols}
+            for symbol, orders in result.items():
+                self._store_open_orders(symbol, orders, now)
+            return result
+        except Exception as e:
+            logger.error(f"❌ 批量获取挂单失败: {e}")
+            return None
     
     def cancel_all_orders(self, symbol: str) -> bool:
         """取消所有未成交订单"""
@@ -399,6 +838,16 @@ class MACDStrategy:
             logger.error(f"❌ 批量取消订单失败: {e}")
             return False
 
+    def _wait_orders_cancelled(self, symbol: str, timeout: float = 1.0, interval: float = 0.2) -> bool:
+        """轮询挂单直到撤销完成或超时，替代固定等待"""
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(interval)
+            if not self.get_open_orders(symbol):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
     def cancel_symbol_tp_sl(self, symbol: str) -> bool:
         """撤销该交易对在OKX侧已挂的TP/SL（OCO）条件单"""
         try:
@@ -424,12 +873,36 @@ class MACDStrategy:
                 self.exchange.privatePostTradeCancelAlgos({'algoIds': algo_ids})
             except Exception:
                 self.exchange.privatePostTradeCancelAlgos({'algoIds': [x['algoId'] for x in algo_ids], 'instId': inst_id})
+            self._placed_tp_sl.pop(symbol, None)
             logger.info(f"✅ 撤销 {symbol} 已挂 OCO 条件单数量: {len(algo_ids)}")
             return True
         except Exception as e:
             logger.warning(f"⚠️ 撤销 {symbol} 条件单失败: {e}")
             return False
     
+    def cancel_tp_sl_batch(self, symbols: List[str]) -> bool:
+        """批量撤销多个交易对的OCO条件单：一次查询全部待触发条件单，按每批10个合并撤销"""
+        try:
+            inst_ids = {self.symbol_to_inst_id(sym) for sym in symbols}
+            resp = self.exchange.privateGetTradeOrdersAlgoPending({'instType': 'SWAP', 'ordType': 'oco'})
+            data = resp.get('data') if isinstance(resp, dict) else resp
+            algo_ids = []
+            for it in (data or []):
+                aid = it.get('algoId') or it.get('algoID') or it.get('id')
+                if aid and it.get('instId') in inst_ids and (it.get('ordType') or '').lower() == 'oco':
+                    algo_ids.append({'algoId': str(aid), 'instId': it.get('instId')})
+            # OKX 单次最多撤销10个条件单
+            for i in range(0, len(algo_ids), 10):
+                self.exchange.privatePostTradeCancelAlgos({'algoIds': algo_ids[i:i + 10]})
+            for sym in symbols:
+                self._placed_tp_sl.pop(sym, None)
+            if algo_ids:
+                logger.info(f"✅ 批量撤销 OCO 条件单数量: {len(algo_ids)}（{len(inst_ids)}个币种）")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ 批量撤销条件单失败，逐个撤销: {e}")
+            return all([self.cancel_symbol_tp_sl(sym) for sym in symbols])
+
     def sync_all_status(self):
         """同步所有状态（持仓和挂单）"""
         try:
@@ -442,35 +915,37 @@ class MACDStrategy:
             has_positions = False
             has_orders = False
             
+            # 账户级批量拉取：持仓与挂单各一次请求
+            all_positions = self.fetch_all_positions() or {}
+            all_orders = self.fetch_all_open_orders()
+            
             for symbol in self.symbols:
                 # 同步持仓
-                position = self.get_position(symbol, force_refresh=True)
-                self.positions_cache[symbol] = position
+                position = all_positions.get(symbol) or self.get_position(symbol, force_refresh=True)
                 
                 # 记录持仓状态
                 if position['size'] > 0:
                     self.last_position_state[symbol] = position['side']
-                # 启动时为已有持仓补挂交易所侧TP/SL
-                try:
-                    kl = self.get_klines(symbol, 50)
-                    atr_p = int((os.environ.get('ATR_PERIOD') or '14').strip())
-                    atr_val = self.calculate_atr(kl, atr_p) if kl else 0.0
-                    entry = float(position.get('entry_price', 0) or 0)
-                    if atr_val > 0 and entry > 0:
-                        okx_ok = self.place_okx_tp_sl(symbol, entry, position.get('side', 'long'), atr_val)
-                        if okx_ok:
-                            logger.info(f"📌 已为已有持仓补挂TP/SL {symbol}")
-                        else:
-                            logger.warning(f"⚠️ 补挂交易所侧TP/SL失败 {symbol}")
-                except Exception as _e:
-                    logger.warning(f"⚠️ 补挂交易所侧TP/SL异常 {symbol}: {_e}")
                     has_positions = True
+                    # 启动时为已有持仓补挂交易所侧TP/SL
+                    try:
+                        kl = self.get_klines(symbol, 50)
+                        atr_val = self.calculate_atr(self.klines_soa.get(symbol, kl), self.atr_period) if kl else 0.0
+                        entry = position['entry_price']
+                        if atr_val > 0 and entry > 0:
+                            okx_ok = self.place_okx_tp_sl(symbol, entry, position['side'], atr_val, position)
+                            if okx_ok:
+                                logger.info(f"📌 已为已有持仓补挂TP/SL {symbol}")
+                            else:
+                                logger.warning(f"⚠️ 补挂交易所侧TP/SL失败 {symbol}")
+                    except Exception as _e:
+                        logger.warning(f"⚠️ 补挂交易所侧TP/SL异常 {symbol}: {_e}")
                 else:
                     self.last_position_state[symbol] = 'none'
+                    self._clear_tp_sl_state(symbol)
                 
-                # 同步挂单
-                orders = self.get_open_orders(symbol)
-                self.open_orders_cache[symbol] = orders
+                # 同步挂单（批量/单个查询时均已写入 open_orders_cache）
+                orders = all_orders[symbol] if all_orders is not None else self.get_open_orders(symbol)
                 
                 # 输出状态
                 if position['size'] > 0:
@@ -508,9 +983,12 @@ class MACDStrategy:
         logger.info(f"💰 当前可用余额: {balance:.4f} USDT")
         logger.info(f"💡 小币种交易：即使只有0.1U也可以下单")
         
+        all_positions = self.fetch_all_positions() or {}
+        all_orders = self.fetch_all_open_orders()
+        
         for symbol in self.symbols:
             # 检查持仓
-            position = self.get_position(symbol, force_refresh=True)
+            position = all_positions.get(symbol) or self.get_position(symbol, force_refresh=True)
             if position['size'] > 0:
                 has_positions = True
                 logger.warning(f"⚠️ 检测到{symbol}已有持仓: {position['side']} {position['size']:.6f} @{position['entry_price']:.4f} PNL:{position['unrealized_pnl']:.2f}U")
@@ -518,7 +996,7 @@ class MACDStrategy:
                 self.last_position_state[symbol] = position['side']
             
             # 检查挂单
-            orders = self.get_open_orders(symbol)
+            orders = all_orders[symbol] if all_orders is not None else self.get_open_orders(symbol)
             if orders:
                 has_orders = True
                 logger.warning(f"⚠️ 检测到{symbol}有{len(orders)}个未成交订单")
@@ -556,12 +1034,13 @@ class MACDStrategy:
                 pnl = position['unrealized_pnl']
                 total_pnl += pnl
                 pnl_emoji = "📈" if pnl > 0 else "📉" if pnl < 0 else "➖"
-                logger.info(f"{pnl_emoji} {symbol}: {position['side'].upper()} | 数量:{position['size']:.6f} | 入场价:{position['entry_price']:.2f} | 盈亏:{pnl:.2f}U | 杠杆:{position['leverage']}x")
+                logger.info("%s %s: %s | 数量:%.6f | 入场价:%.2f | 盈亏:%.2fU | 杠杆:%sx",
+                            pnl_emoji, symbol, position['side'].upper(), position['size'], position['entry_price'], pnl, position['leverage'])
         
         if has_positions:
             total_emoji = "💰" if total_pnl > 0 else "💸" if total_pnl < 0 else "➖"
             logger.info("-" * 70)
-            logger.info(f"{total_emoji} 总浮动盈亏: {total_pnl:.2f} USDT")
+            logger.info("%s 总浮动盈亏: %.2f USDT", total_emoji, total_pnl)
         else:
             logger.info("ℹ️ 当前无持仓")
         
@@ -575,7 +1054,10 @@ class MACDStrategy:
             self.sync_all_status()
     
     def get_account_balance(self) -> float:
-        """获取账户余额（OKX原生接口）"""
+        """获取账户余额（OKX原生接口）；短TTL缓存，同一轮巡检内的展示与下单金额计算共用一次查询，下单成功后作废"""
+        cached = self._balance_cache
+        if cached is not None and time.monotonic() - cached[1] < self._balance_ttl:
+            return cached[0]
         try:
             resp = self.exchange.privateGetAccountBalance({})
             data = resp.get('data') if isinstance(resp, dict) else resp
@@ -591,41 +1073,176 @@ class MACDStrategy:
                         except Exception:
                             avail = 0.0
                         break
+            self._balance_cache = (avail, time.monotonic())
             return avail
         except Exception as e:
             logger.error(f"❌ 获取账户余额失败: {e}")
             return 0.0
     
     def get_klines(self, symbol: str, limit: int = 100) -> List[Dict]:
-        """获取K线数据 - 5分钟周期（OKX v5 原生接口）"""
+        """获取K线数据 - 5分钟周期（OKX v5 原生接口）；WS推送缓冲新鲜且足量时直接读内存；同一轮巡检内复用已取结果"""
+        memo = self._klines_memo.get(symbol) if self._tick_id else None
+        if memo and memo[0] == self._tick_id and len(memo[1]) >= limit:
+            self.klines_soa[symbol] = {k: v[-limit:] for k, v in memo[2].items()}
+            return memo[1][-limit:]
+        klines = self._fetch_klines(symbol, limit)
+        if self._tick_id and klines:
+            self._klines_memo[symbol] = (self._tick_id, klines, self.klines_soa[symbol])
+        return klines
+
+    def _fetch_klines(self, symbol: str, limit: int) -> List[Dict]:
+        """实际取K线：WS缓冲优先，否则走REST"""
+        if self.use_ws_klines:
+            with self._ws_lock:
+                buf = self._ws_klines.get(symbol)
+                fresh = buf is not None and len(buf) >= limit and time.time() - self._ws_kline_ts.get(symbol, 0) < self._ws_stale_sec
+                # 只取环形缓冲尾部 limit 根，不复制整个 deque
+                rows = list(islice(buf, len(buf) - limit, None)) if fresh else None
+            if rows:
+                return self._klines_from_array(symbol, np.array(rows, dtype=float))
         try:
             inst_id = self.symbol_to_inst_id(symbol)
+            # 同一根K线周期内只拉最新1根并覆盖缓存窗口的最后一行；新K线开盘或缓存不足时整窗拉取
+            cached = self._rest_klines.get(symbol)
+            bucket_ms = int(time.time() // self._tf_seconds * self._tf_seconds * 1000)
+            partial = cached is not None and len(cached) >= limit and cached[-1, 0] >= bucket_ms
             # OKX v5: /api/v5/market/candles?instId=...&bar=15m&limit=...
-            params = {'instId': inst_id, 'bar': self.timeframe, 'limit': str(limit)}
+            params = {'instId': inst_id, 'bar': self.timeframe, 'limit': '1' if partial else str(limit)}
             resp = self.exchange.publicGetMarketCandles(params)
             rows = resp.get('data') if isinstance(resp, dict) else resp
-            result: List[Dict] = []
-            for r in (rows or []):
-                # OKX返回: [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]
-                ts = int(r[0])
-                o = float(r[1]); h = float(r[2]); l = float(r[3]); c = float(r[4]); v = float(r[5])
-                result.append({
-                    'timestamp': pd.to_datetime(ts, unit='ms'),
-                    'open': o, 'high': h, 'low': l, 'close': c, 'volume': v
-                })
-            # OKX通常返回从新到旧，按时间升序
-            result.sort(key=lambda x: x['timestamp'])
-            return result
+            if not rows:
+                self.klines_soa.pop(symbol, None)
+                return []
+            # OKX返回: [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]，一次性转为二维数组
+            arr = np.array([r[:6] for r in rows], dtype=float)
+            if partial:
+                if arr[0, 0] != cached[-1, 0]:
+                    # 本地时钟与交易所周期边界不一致（已开新K线），回退整窗拉取
+                    self._rest_klines.pop(symbol, None)
+                    return self._fetch_klines(symbol, limit)
+                full = np.concatenate((cached[:-1], arr[:1]))
+                self._rest_klines[symbol] = full
+                arr = full[-limit:]
+            else:
+                # OKX通常返回从新到旧，按时间升序
+                arr = arr[arr[:, 0].argsort(kind='stable')]
+                self._rest_klines[symbol] = arr
+            if self.use_ws_klines:
+                # 以REST结果为WS缓冲打底，此后由推送增量更新
+                with self._ws_lock:
+                    self._ws_klines[symbol] = deque(arr.tolist(), maxlen=max(300, limit))
+                    self._ws_kline_ts[symbol] = time.time()
+            return self._klines_from_array(symbol, arr)
         except Exception as e:
             logger.error(f"❌ 获取{symbol}K线数据失败: {e}")
+            self.klines_soa.pop(symbol, None)
             return []
     
+    def _klines_from_array(self, symbol: str, arr: np.ndarray) -> List[Dict]:
+        """按时间升序的 [ts, o, h, l, c, vol] 二维数组 → 写入 klines_soa 并返回K线字典列表；
+        timestamp 为毫秒整数（下游只用于比较/作键，不逐行构造 pandas 时间对象）"""
+        cols = np.ascontiguousarray(arr.T)
+        self.klines_soa[symbol] = {'high': cols[2], 'low': cols[3], 'close': cols[4]}
+        return [{
+            'timestamp': int(ts),
+            'open': o, 'high': h, 'low': l, 'close': c, 'volume': v
+        } for ts, o, h, l, c, v in arr.tolist()]
+
+    def start_kline_ws(self):
+        """启动后台线程：独立事件循环中用 ccxt.pro 单连接订阅全部币种K线（watch_ohlcv_for_symbols）"""
+        if not self.use_ws_klines or (self._ws_thread and self._ws_thread.is_alive()):
+            return
+        self._ws_thread = threading.Thread(target=lambda: asyncio.run(self._kline_ws_loop()), name='kline-ws', daemon=True)
+        self._ws_thread.start()
+        logger.info("📡 已启动K线WebSocket订阅（%s，%d个币种）", self.timeframe, len(self.symbols))
+
+    async def _kline_ws_loop(self):
+        """K线推送循环：断线/异常后自动重试；推送合并进 _ws_klines（同一时间戳覆盖，新K线追加）。
+        前一根K线的最终确认推送可能晚于新K线首推，按时间戳从尾部回查覆盖；已收盘K线被改写时作废该币种的前一根指标状态缓存"""
+        ex = ccxtpro.okx({'enableRateLimit': True, 'options': {'defaultType': 'swap'}})
+        # 实例的 parse_json 只作用于该客户端的 REST 请求；推送帧解码需单独替换
+        self._install_fast_json(ex)
+        self._install_fast_ws_json()
+        pairs = [[symbol, self.timeframe] for symbol in self.symbols]
+        delay = 1.0
+        try:
+            while True:
+                try:
+                    data = await ex.watch_ohlcv_for_symbols(pairs)
+                except Exception as e:
+                    # 指数退避+随机抖动，连续失败时不反复冲击交易所；收到推送后复位
+                    wait = delay + random.random() * delay * 0.5
+                    logger.warning("⚠️ K线WebSocket异常，%.1f秒后重连: %s", wait, e)
+                    await asyncio.sleep(wait)
+                    delay = min(delay * 2, 30.0)
+                    continue
+                delay = 1.0
+                now = time.time()
+                new_bar = False
+                revised: Set[str] = set()
+                with self._ws_lock:
+                    for symbol, by_tf in (data or {}).items():
+                        buf = self._ws_klines.get(symbol)
+                        if buf is None:
+                            continue  # 尚未用REST打底，等待首次 get_klines
+                        for rows in by_tf.values():
+                            for r in rows:
+                                row = [float(x or 0) for x in r[:6]]
+                                if not buf or row[0] > buf[-1][0]:
+                                    new_bar = new_bar or bool(buf)
+                                    buf.append(row)
+                                    continue
+                                # 从尾部回查同一时间戳（只看最近几根），找不到的过旧推送丢弃
+                                for i in range(len(buf) - 1, max(len(buf) - 5, 0) - 1, -1):
+                                    if buf[i][0] == row[0]:
+                                        if i < len(buf) - 1 and buf[i] != row:
+                                            revised.add(symbol)
+                                        buf[i] = row
+                                        break
+                                    if buf[i][0] < row[0]:
+                                        break
+                        self._ws_kline_ts[symbol] = now
+                for symbol in revised:
+                    self._drop_bar_state(symbol)
+                if new_bar:
+                    self._new_bar_event.set()
+        finally:
+            await ex.close()
+
+    def _drop_bar_state(self, symbol: str):
+        """作废该币种缓存的前一根 MACD/ATR/ADX 递推状态，下次计算整窗重算"""
+        self._macd_state.pop(symbol, None)
+        self._atr_state.pop(symbol, None)
+        self._adx_state.pop(symbol, None)
+
+    def _get_last_price(self, inst_id: str) -> float:
+        """获取最新价（带缓存）：过期时用 /market/tickers 一次刷新全部SWAP最新价"""
+        cached = self._ticker_cache.get(inst_id)
+        now = time.time()
+        if cached and now - cached[1] < self._ticker_ttl:
+            return cached[0]
+        try:
+            resp = self.exchange.publicGetMarketTickers({'instType': 'SWAP'})
+            data = resp.get('data') if isinstance(resp, dict) else resp
+            for d in (data or []):
+                try:
+                    last = float(d.get('last') or d.get('lastPx') or 0.0)
+                except Exception:
+                    continue
+                if last > 0:
+                    self._ticker_cache[d.get('instId')] = (last, now)
+        except Exception as e:
+            logger.error(f"❌ 批量获取最新价失败({inst_id}): {e}")
+        cached = self._ticker_cache.get(inst_id)
+        return cached[0] if cached and now - cached[1] < self._ticker_ttl else 0.0
+
     def get_position(self, symbol: str, force_refresh: bool = False) -> Dict[str, Any]:
         """获取当前持仓（带缓存）"""
         try:
-            # 如果不强制刷新且缓存存在，返回缓存
+            # 如果不强制刷新且缓存未过期（sync_interval 内），直接返回缓存
             if not force_refresh and symbol in self.positions_cache:
-                return self.positions_cache[symbol]
+                if time.time() - self._position_cache_ts.get(symbol, 0) < self.sync_interval:
+                    return self.positions_cache[symbol]
             
             # 从交易所获取最新持仓
             # 使用OKX原生接口获取持仓，避免markets依赖
@@ -634,24 +1251,15 @@ class MACDStrategy:
             data = resp.get('data') if isinstance(resp, dict) else resp
             for p in (data or []):
                 if p.get('instId') == inst_id and float(p.get('pos', 0) or 0) != 0:
-                    size = abs(float(p.get('pos', 0) or 0))
-                    side = 'long' if p.get('posSide') == 'long' else 'short'
-                    entry_price = float(p.get('avgPx', 0) or 0)
-                    leverage = float(p.get('lever', 0) or 0)
-                    unreal = float(p.get('upl', 0) or 0)
-                    pos_data = {
-                        'size': size,
-                        'side': side,
-                        'entry_price': entry_price,
-                        'unrealized_pnl': unreal,
-                        'leverage': leverage,
-                    }
+                    pos_data = self._parse_position(p)
                     self.positions_cache[symbol] = pos_data
+                    self._position_cache_ts[symbol] = time.time()
                     return pos_data
             
             # 无持仓
             pos_data = {'size': 0, 'side': 'none', 'entry_price': 0, 'unrealized_pnl': 0, 'leverage': 0}
             self.positions_cache[symbol] = pos_data
+            self._position_cache_ts[symbol] = time.time()
             return pos_data
             
         except Exception as e:
@@ -661,9 +1269,58 @@ class MACDStrategy:
                 return self.positions_cache[symbol]
             return {'size': 0, 'side': 'none', 'entry_price': 0, 'unrealized_pnl': 0, 'leverage': 0}
     
+    def _wait_position_filled(self, symbol: str, want_open: bool = True, timeout: float = 2.0, interval: float = 0.1) -> Dict[str, Any]:
+        """下单/平仓后轮询持仓，直到已开仓（want_open=True）或已平仓（want_open=False）或超时，返回最新持仓"""
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(interval)
+            pos = self.get_position(symbol, force_refresh=True)
+            if (pos['size'] > 0) == want_open or time.monotonic() >= deadline:
+                return pos
+
+    def _parse_position(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        """将OKX原生持仓转换为内部结构"""
+        return {
+            'size': abs(float(p.get('pos', 0) or 0)),
+            'side': 'long' if p.get('posSide') == 'long' else 'short',
+            'entry_price': float(p.get('avgPx', 0) or 0),
+            'unrealized_pnl': float(p.get('upl', 0) or 0),
+            'leverage': float(p.get('lever', 0) or 0),
+        }
+
+    def fetch_all_positions(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """一次请求获取全部SWAP持仓（不传instId），写入持仓缓存；失败返回None"""
+        try:
+            resp = self.exchange.privateGetAccountPositions({'instType': 'SWAP'})
+            data = resp.get('data') if isinstance(resp, dict) else resp
+            by_inst: Dict[str, Dict[str, Any]] = {}
+            for p in (data or []):
+                inst_id = p.get('instId')
+                if inst_id and inst_id not in by_inst and float(p.get('pos', 0) or 0) != 0:
+                    by_inst[inst_id] = p
+            now = time.time()
+            result: Dict[str, Dict[str, Any]] = {}
+            for symbol in self.symbols:
+                p = by_inst.get(self.symbol_to_inst_id(symbol))
+                if p:
+                    pos_data = self._parse_position(p)
+                else:
+                    pos_data = {'size': 0, 'side': 'none', 'entry_price': 0, 'unrealized_pnl': 0, 'leverage': 0}
+                self.positions_cache[symbol] = pos_data
+                self._position_cache_ts[symbol] = now
+                result[symbol] = pos_data
+            return result
+        except Exception as e:
+            logger.error(f"❌ 批量获取持仓失败: {e}")
+            return None
+
     def has_open_orders(self, symbol: str) -> bool:
-        """检查是否有未成交订单"""
+        """检查是否有未成交订单；本地缓存确认无挂单且未过期时直接返回，省去一次接口请求"""
         try:
+            if (symbol not in self._open_orders_known
+                    and time.time() - self._open_orders_cache_ts.get(symbol, 0) < self._open_orders_ttl
+                    and not self.open_orders_cache.get(symbol)):
+                return False
             orders = self.get_open_orders(symbol)
             has_orders = len(orders) > 0
             if has_orders:
@@ -737,6 +1394,47 @@ class MACDStrategy:
             logger.error(f"❌ 计算{symbol}下单金额失败: {e}")
             return 0.0
     
+    @staticmethod
+    def _extract_order_id(resp: Any) -> Optional[str]:
+        """从 ccxt 统一接口返回或 OKX 原生返回（data 列表）中提取订单ID"""
+        if isinstance(resp, dict):
+            data = resp.get('data')
+            if isinstance(data, list) and data and isinstance(data[0], dict):
+                resp = data[0]
+        elif isinstance(resp, list) and resp and isinstance(resp[0], dict):
+            resp = resp[0]
+        else:
+            return None
+        return resp.get('id') or resp.get('orderId') or resp.get('ordId') or resp.get('clOrdId')
+
+    def _submit_market_order(self, symbol: str, side: str, size: float, params: Dict[str, Any],
+                             raw_params: Dict[str, Any], native_only: bool = False, tag: str = '下单') -> Tuple[Optional[str], Optional[Exception]]:
+        """优先用 OKX原生接口 提交市价单（参数固定，一次请求），失败时才退回 统一接口create_order → create_market_order；
+        拿到订单ID即停止；返回 (order_id, last_err)"""
+        attempts = [('OKX原生接口', lambda: self.exchange.privatePostTradeOrder(raw_params))]
+        if not native_only:
+            attempts.append(('create_order', lambda: self.exchange.create_order(symbol, 'market', side, size, None, params)))
+            attempts.append(('create_market_order', lambda: self.exchange.create_market_order(symbol, side, size, None, params)))  # type: ignore[arg-type]
+        last_err: Optional[Exception] = None
+        for name, call in attempts:
+            try:
+                resp = call()
+            except Exception as e:
+                last_err = e
+                logger.error("❌ %s %s 异常: %s", tag, name, e)
+                # 堆栈格式化开销大，仅在 DEBUG 开启时生成
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(traceback.format_exc())
+                continue
+            order_id = self._extract_order_id(resp)
+            if order_id:
+                # 市价单成交前可能短暂挂着，确认成交前视为可能有挂单；保证金已变化，余额缓存作废
+                self._open_orders_known.add(symbol)
+                self._balance_cache = None
+                return order_id, last_err
+            logger.warning("⚠️ %s %s 返回未包含订单ID，响应: %s", tag, name, resp)
+        return None, last_err
+
     def create_order(self, symbol: str, side: str, amount: float) -> bool:
         """创建订单 - 小币种版本，支持小额交易（OKX原生下单，避免精度与symbol转换问题）"""
         try:
@@ -744,7 +1442,7 @@ class MACDStrategy:
             if self.has_open_orders(symbol):
                 logger.warning(f"⚠️ {symbol}存在未成交订单，先取消")
                 self.cancel_all_orders(symbol)
-                time.sleep(1)  # 等待订单取消
+                self._wait_orders_cancelled(symbol)  # 等待订单取消
 
             if amount <= 0:
                 logger.warning(f"⚠️ {symbol}下单金额为0，跳过")
@@ -755,23 +1453,17 @@ class MACDStrategy:
             min_amount = float(market_info.get('min_amount', 0.001) or 0.001)
             amount_precision = int(market_info.get('amount_precision', 8) or 8)
             lot_sz = market_info.get('lot_size')  # 可能为 None
+            amount_scale = market_info.get('amount_scale')  # lotSz 为10的整数次幂时的整数倍率，可能为 None
+
+            def _ceil_lot(x: float, step: float) -> float:
+                # 向上对齐到步进：有整数倍率时在整数域取整，省去一次除法
+                if amount_scale:
+                    return math.ceil(x * amount_scale) / amount_scale
+                return math.ceil(x / step) * step
 
             # 获取当前价格（使用 OKX v5 原生接口，避免 ccxt 统一接口的 None + 'str' 问题）
             inst_id = self.symbol_to_inst_id(symbol)
-            try:
-                tkr = self.exchange.publicGetMarketTicker({'instId': inst_id})
-                # OKX v5 返回结构 { code, data: [{ last: '...', ... }], msg }
-                if isinstance(tkr, dict):
-                    d = tkr.get('data') or []
-                    if isinstance(d, list) and d:
-                        current_price = float(d[0].get('last') or d[0].get('lastPx') or 0.0)
-                    else:
-                        current_price = 0.0
-                else:
-                    current_price = 0.0
-            except Exception as _e:
-                logger.error(f"❌ 获取{symbol}最新价失败({inst_id}): {_e}")
-                current_price = 0.0
+            current_price = self._get_last_price(inst_id)
 
             if not current_price or current_price <= 0:
                 logger.error(f"❌ 无法获取{symbol}有效价格，跳过下单")
@@ -790,7 +1482,7 @@ class MACDStrategy:
                 try:
                     step = float(lot_sz)
                     if step and step > 0:
-                        contract_size = math.ceil(contract_size / step) * step
+                        contract_size = _ceil_lot(contract_size, step)
                 except Exception:
                     step = None
             contract_size = round(contract_size, amount_precision)
@@ -800,7 +1492,7 @@ class MACDStrategy:
                 contract_size = max(min_amount, 10 ** (-amount_precision))
                 if step and step > 0:
                     try:
-                        contract_size = math.ceil(contract_size / step) * step
+                        contract_size = _ceil_lot(contract_size, step)
                     except Exception:
                         pass
                 contract_size = round(contract_size, amount_precision)
@@ -813,13 +1505,13 @@ class MACDStrategy:
                     need_qty = (amount - used_usdt) / current_price
                     incr_step = step if (step and step > 0) else (10 ** (-amount_precision))
                     # 向上取整到合法步进
-                    add_qty = math.ceil(need_qty / incr_step) * incr_step
+                    add_qty = _ceil_lot(need_qty, incr_step)
                     contract_size = round(contract_size + add_qty, amount_precision)
                     # 再次确保不低于最小数量
                     if contract_size < min_amount:
                         contract_size = min_amount
                         if step and step > 0:
-                            contract_size = math.ceil(contract_size / step) * step
+                            contract_size = _ceil_lot(contract_size, step)
                         contract_size = round(contract_size, amount_precision)
             except Exception:
                 pass
@@ -836,107 +1528,48 @@ class MACDStrategy:
             except Exception:
                 pass
 
-            pos_side = 'long' if side == 'buy' else 'short'
-            order_id = None
-            last_err = None
+            pos_side = self._pos_side_of[side]
+            params = self._params_templates[(pos_side, False)]
 
             # 打印当前 ccxt 版本配置，便于排查
             try:
                 ex_ver = getattr(self.exchange, 'version', None)
                 opt_ver = (self.exchange.options or {}).get('version') if getattr(self.exchange, 'options', None) else None
-                logger.debug(f"🔧 CCXT version: {ex_ver}, options.version: {opt_ver}")
+                logger.debug("🔧 CCXT version: %s, options.version: %s", ex_ver, opt_ver)
             except Exception:
                 pass
 
-            import traceback
-
             # 可选：仅用原生接口（通过环境变量控制）
-            native_only = False
-            try:
-                native_only = (os.environ.get('USE_OKX_NATIVE_ONLY', '').strip().lower() in ('1', 'true', 'yes'))
-            except Exception:
-                native_only = False
-
-            # 尝试1：统一接口 create_order（若未启用仅原生）
-            if not native_only:
-                try:
-                    params = {'tdMode': 'cross', 'posSide': pos_side}
-                    resp = self.exchange.create_order(symbol, 'market', side, contract_size, None, params)
-                    if isinstance(resp, dict):
-                        order_id = resp.get('id') or resp.get('orderId') or resp.get('ordId') or resp.get('clOrdId')
-                    elif isinstance(resp, list) and resp and isinstance(resp[0], dict):
-                        order_id = resp[0].get('id') or resp[0].get('orderId') or resp[0].get('ordId') or resp[0].get('clOrdId')
-                    if order_id:
-                        logger.info(f"✅ 成功创建{symbol} {side}订单，数量:{contract_size:.8f}，订单ID:{order_id}")
-                    else:
-                        logger.warning(f"⚠️ create_order 返回未包含订单ID，响应: {resp}")
-                except Exception as e1:
-                    last_err = e1
-                    logger.error(f"❌ create_order 异常: {e1}")
-                    logger.debug(traceback.format_exc())
-
-            # 尝试2：create_market_order（若尚未拿到ID且未启用仅原生）
-            if not order_id and not native_only:
-                try:
-                    params = {'tdMode': 'cross', 'posSide': pos_side}
-                    resp = self.exchange.create_market_order(symbol, side, contract_size, None, params)  # type: ignore[arg-type]
-                    if isinstance(resp, dict):
-                        order_id = resp.get('id') or resp.get('orderId') or resp.get('ordId') or resp.get('clOrdId')
-                    elif isinstance(resp, list) and resp and isinstance(resp[0], dict):
-                        order_id = resp[0].get('id') or resp[0].get('orderId') or resp[0].get('ordId') or resp[0].get('clOrdId')
-                    if order_id:
-                        logger.info(f"✅ 成功创建{symbol} {side}订单（market API），数量:{contract_size:.8f}，订单ID:{order_id}")
-                    else:
-                        logger.warning(f"⚠️ create_market_order 返回未包含订单ID，响应: {resp}")
-                except Exception as e2:
-                    last_err = e2
-                    logger.error(f"❌ create_market_order 异常: {e2}")
-                    logger.debug(traceback.format_exc())
-
-            # 尝试3：OKX 原生接口（最后兜底）
-            if not order_id:
-                try:
-                    inst_id = self.symbol_to_inst_id(symbol)
-                    raw_params = {
-                        'instId': inst_id,
-                        'tdMode': 'cross',
-                        'side': side,
-                        'posSide': pos_side,
-                        'ordType': 'market',
-                        'sz': str(contract_size)
-                    }
-                    resp = self.exchange.privatePostTradeOrder(raw_params)
-                    # 兼容 OKX v5 返回结构
-                    if isinstance(resp, dict):
-                        data = resp.get('data') or []
-                        if isinstance(data, list) and data:
-                            order_id = data[0].get('ordId') or data[0].get('clOrdId') or data[0].get('id')
-                        else:
-                            order_id = resp.get('ordId') or resp.get('clOrdId') or resp.get('id')
-                    if order_id:
-                        logger.info(f"✅ 成功创建{symbol} {side}订单（OKX原生兜底），数量:{contract_size:.8f}，订单ID:{order_id}")
-                    else:
-                        logger.error(f"❌ OKX原生下单无订单ID，响应: {resp}")
-                except Exception as e3:
-                    last_err = e3
-                    logger.error(f"❌ OKX原生下单异常: {e3}")
-                    logger.debug(traceback.format_exc())
+            native_only = (os.environ.get('USE_OKX_NATIVE_ONLY', '').strip().lower() in ('1', 'true', 'yes'))
 
+            raw_params = {
+                'instId': inst_id,
+                'tdMode': 'cross',
+                'side': side,
+                'posSide': pos_side,
+                'ordType': 'market',
+                'sz': str(contract_size)
+            }
+            order_id, last_err = self._submit_market_order(symbol, side, contract_size, params, raw_params, native_only, '下单')
             if order_id:
-                time.sleep(2)
-                pos = self.get_position(symbol, force_refresh=True)
+                logger.info(f"✅ 成功创建{symbol} {side}订单，数量:{contract_size:.8f}，订单ID:{order_id}")
+                pos = self._wait_position_filled(symbol)
+                if pos['size'] > 0:
+                    self._open_orders_known.discard(symbol)  # 已成交，市价单不再挂着
                 # 设置初始 SL/TP（基于最新 ATR）
                 try:
                     kl = self.get_klines(symbol, 50)
-                    atr_p = int((os.environ.get('ATR_PERIOD') or '14').strip())
-                    atr_val = self.calculate_atr(kl, atr_p) if kl else 0.0
-                    if pos and pos.get('size', 0) > 0 and atr_val > 0:
-                        self._set_initial_sl_tp(symbol, float(pos.get('entry_price', 0) or 0), atr_val, pos.get('side', 'long'))
+                    atr_val = self.calculate_atr(self.klines_soa.get(symbol, kl), self.atr_period) if kl else 0.0
+                    if pos['size'] > 0 and atr_val > 0:
+                        self._set_initial_sl_tp(symbol, pos['entry_price'], atr_val, pos['side'])
                         st = self.sl_tp_state.get(symbol)
                         if st:
                             logger.info(f"🎯 初始化SL/TP {symbol}: SL={st['sl']:.6f}, TP={st['tp']:.6f} (N={self.atr_sl_n}, M={self.atr_tp_m}, ATR={atr_val:.6f})")
-                            okx_ok = self.place_okx_tp_sl(symbol, float(pos.get('entry_price', 0) or 0), pos.get('side', 'long'), atr_val)
+                            # 新开仓必须真正挂单：清掉可能残留的已挂标记，确保 True 代表本次已发送 OCO
+                            self.okx_tp_sl_placed.pop(symbol, None)
+                            okx_ok = self.place_okx_tp_sl(symbol, pos['entry_price'], pos['side'], atr_val, pos)
                             if okx_ok:
+                                st['hung_sl'] = st['sl']
                                 logger.info(f"📌 已在交易所侧挂TP/SL {symbol}")
                             else:
                                 logger.warning(f"⚠️ 交易所侧TP/SL挂单失败 {symbol}")
@@ -951,8 +1584,8 @@ class MACDStrategy:
 
         except Exception as e:
             logger.error(f"❌ 创建{symbol} {side}订单异常: {e}")
-            import traceback as _tb
-            logger.debug(_tb.format_exc())
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(traceback.format_exc())
             return False
     
     def close_position(self, symbol: str, open_reverse: bool = False) -> bool:
@@ -962,7 +1595,7 @@ class MACDStrategy:
             if self.has_open_orders(symbol):
                 logger.info(f"🔄 平仓前先取消{symbol}的挂单")
                 self.cancel_all_orders(symbol)
-                time.sleep(1)
+                self._wait_orders_cancelled(symbol)
             
             # 刷新持仓
             position = self.get_position(symbol, force_refresh=True)
@@ -972,83 +1605,40 @@ class MACDStrategy:
                 return True
             
             # 记录平仓前的盈亏
-            pnl = position.get('unrealized_pnl', 0)
-            position_side = position.get('side', 'unknown')
+            pnl = position['unrealized_pnl']
+            position_side = position['side']
             
             # 获取合约数量
-            size = float(position.get('size', 0) or 0)
+            size = position['size']
             
             # 反向平仓：多头平仓用sell，空头平仓用buy
-            side = 'sell' if position.get('side') == 'long' else 'buy'
+            side = self._close_side_of.get(position_side, 'buy')
+            params = self._params_templates[(position_side, True)]
             
             logger.info(f"📝 准备平仓: {symbol} {side} 数量:{size:.6f} 预计盈亏:{pnl:.2f}U")
 
-            import traceback as _tb
-            order_id = None
-            last_err = None
-
-            # 尝试1：ccxt 统一接口 create_order + reduceOnly
-            try:
-                params = {'reduceOnly': True, 'posSide': position_side, 'tdMode': 'cross'}
-                resp = self.exchange.create_order(symbol, 'market', side, size, None, params)
-                if isinstance(resp, dict):
-                    order_id = resp.get('id') or resp.get('orderId') or resp.get('ordId') or resp.get('clOrdId')
-                elif isinstance(resp, list) and resp and isinstance(resp[0], dict):
-                    order_id = resp[0].get('id') or resp[0].get('orderId') or resp[0].get('ordId') or resp[0].get('clOrdId')
-            except Exception as e1:
-                last_err = e1
-                logger.error(f"❌ 平仓 create_order 异常: {e1}")
-                logger.debug(_tb.format_exc())
-
-            # 尝试2：ccxt create_market_order + reduceOnly
-            if not order_id:
-                try:
-                    params = {'reduceOnly': True, 'posSide': position_side, 'tdMode': 'cross'}
-                    resp = self.exchange.create_market_order(symbol, side, size, None, params)  # type: ignore[arg-type]
-                    if isinstance(resp, dict):
-                        order_id = resp.get('id') or resp.get('orderId') or resp.get('ordId') or resp.get('clOrdId')
-                    elif isinstance(resp, list) and resp and isinstance(resp[0], dict):
-                        order_id = resp[0].get('id') or resp[0].get('orderId') or resp[0].get('ordId') or resp[0].get('clOrdId')
-                except Exception as e2:
-                    last_err = e2
-                    logger.error(f"❌ 平仓 create_market_order 异常: {e2}")
-                    logger.debug(_tb.format_exc())
-
-            # 尝试3：OKX 原生接口兜底
-            if not order_id:
-                try:
-                    inst_id = self.symbol_to_inst_id(symbol)
-                    raw_params = {
-                        'instId': inst_id,
-                        'tdMode': 'cross',
-                        'side': side,
-                        'posSide': position_side,
-                        'reduceOnly': True,
-                        'ordType': 'market',
-                        'sz': str(size)
-                    }
-                    resp = self.exchange.privatePostTradeOrder(raw_params)
-                    if isinstance(resp, dict):
-                        data = resp.get('data') or []
-                        if isinstance(data, list) and data:
-                            order_id = data[0].get('ordId') or data[0].get('clOrdId') or data[0].get('id')
-                        else:
-                            order_id = resp.get('ordId') or resp.get('clOrdId') or resp.get('id')
-                except Exception as e3:
-                    last_err = e3
-                    logger.error(f"❌ 平仓 OKX 原生接口异常: {e3}")
-                    logger.debug(_tb.format_exc())
+            raw_params = {
+                'instId': self.symbol_to_inst_id(symbol),
+                'tdMode': 'cross',
+                'side': side,
+                'posSide': position_side,
+                'reduceOnly': True,
+                'ordType': 'market',
+                'sz': str(size)
+            }
+            order_id, last_err = self._submit_market_order(symbol, side, size, params, raw_params, False, '平仓')
 
             if order_id:
                 logger.info(f"✅ 成功平仓{symbol}，方向: {side}，数量: {size:.6f}，盈亏: {pnl:.2f}U")
                 # 记录交易统计
                 self.stats.add_trade(symbol, position_side, pnl)
-                time.sleep(2)
-                self.get_position(symbol, force_refresh=True)
+                if self._wait_position_filled(symbol, want_open=False).get('size', 0) <= 0:
+                    self._open_orders_known.discard(symbol)  # 已平仓，市价单不再挂着
+                    self._clear_tp_sl_state(symbol)
                 self.last_position_state[symbol] = 'none'
 
                 if open_reverse:
-                    reverse_side = 'sell' if position_side == 'long' else 'buy'
+                    reverse_side = self._close_side_of.get(position_side, 'buy')
                     amount = self.calculate_order_amount(symbol)
                     if amount > 0:
                         if self.create_order(symbol, reverse_side, amount):
@@ -1064,83 +1654,74 @@ class MACDStrategy:
             logger.error(f"❌ 平仓{symbol}失败: {e}")
             return False
     
-    def calculate_macd(self, prices: List[float]) -> Dict[str, Any]:
-        """计算MACD指标"""
-        # 转换为numpy数组
-        close_array = np.array(prices)
-        
-        # 计算EMA
-        ema_fast = pd.Series(close_array).ewm(span=self.fast_period, adjust=False).mean().values
-        ema_slow = pd.Series(close_array).ewm(span=self.slow_period, adjust=False).mean().values
-        
-        # 计算MACD线
-        macd_line = ema_fast - ema_slow
-        
-        # 计算信号线
-        signal_line = pd.Series(macd_line).ewm(span=self.signal_period, adjust=False).mean().values
-        
-        # 计算柱状图
-        histogram = macd_line - signal_line
-        
-        # 返回最新的MACD值
-        return {
-            'macd': macd_line[-1],
-            'signal': signal_line[-1],
-            'histogram': histogram[-1],
-            'macd_line': macd_line,
-            'signal_line': signal_line
-        }
+    def calculate_macd_pair(self, prices: List[float] | np.ndarray, f: int, s: int, si: int,
+                            symbol: Optional[str] = None, bar_key: Any = None) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """返回 (前一根MACD, 最新MACD)：前一根的EMA状态由一次遍历得到，最新一根在其上再递推一步。
+        传入 symbol 与 bar_key（K线窗口首/末时间）时缓存前一根状态：窗口未滚动（仍是同一根实时K线）则跳过遍历，只做一步递推"""
+        key = (f, s, si)
+        alphas = self._macd_alphas.get(key)
+        if alphas is None:
+            alphas = self._macd_alphas[key] = (2.0 / (int(f) + 1), 2.0 / (int(s) + 1), 2.0 / (int(si) + 1))
+        state_key = (bar_key, key)
+        cached = self._macd_state.get(symbol) if symbol is not None and bar_key is not None else None
+        if cached is not None and cached[0] == state_key:
+            ema_f, ema_s, sig = cached[1]
+        else:
+            ema_f, ema_s, sig = _macd_prev_state_kernel(np.asarray(prices, dtype=float), *alphas)
+            if symbol is not None and bar_key is not None:
+                self._macd_state[symbol] = (state_key, (ema_f, ema_s, sig))
+        alpha_f, alpha_s, alpha_si = alphas
+        macd_p = ema_f - ema_s
+        x = float(prices[-1])
+        ema_f = (1.0 - alpha_f) * ema_f + alpha_f * x
+        ema_s = (1.0 - alpha_s) * ema_s + alpha_s * x
+        macd_c = ema_f - ema_s
+        sig_c = (1.0 - alpha_si) * sig + alpha_si * macd_c
+        return ({'macd': float(macd_p), 'signal': float(sig), 'histogram': float(macd_p - sig)},
+                {'macd': float(macd_c), 'signal': float(sig_c), 'histogram': float(macd_c - sig_c)})
+
+    def calculate_macd(self, prices: List[float], with_lines: bool = False) -> Dict[str, Any]:
+        """计算MACD指标（默认参数）"""
+        return self.calculate_macd_with_params(prices, self.fast_period, self.slow_period, self.signal_period, with_lines)
     
-    def calculate_macd_with_params(self, prices: List[float], f: int, s: int, si: int) -> Dict[str, Any]:
-        """按指定参数计算MACD"""
-        close_array = np.array(prices)
-        ema_fast = pd.Series(close_array).ewm(span=f, adjust=False).mean().values
-        ema_slow = pd.Series(close_array).ewm(span=s, adjust=False).mean().values
-        macd_line = ema_fast - ema_slow
-        signal_line = pd.Series(macd_line).ewm(span=si, adjust=False).mean().values
-        histogram = macd_line - signal_line
-        return {
-            'macd': macd_line[-1],
-            'signal': signal_line[-1],
-            'histogram': histogram[-1],
-            'macd_line': macd_line,
-            'signal_line': signal_line
+    def calculate_macd_with_params(self, prices: List[float], f: int, s: int, si: int, with_lines: bool = False) -> Dict[str, Any]:
+        """按指定参数计算MACD；默认只返回最新值，with_lines=True 时附带完整 macd_line/signal_line"""
+        close_array = np.asarray(prices, dtype=float)
+        macd, signal, histogram = _macd_kernel(close_array, int(f), int(s), int(si))
+        result: Dict[str, Any] = {
+            'macd': float(macd),
+            'signal': float(signal),
+            'histogram': float(histogram),
         }
+        if with_lines:
+            result['macd_line'], result['signal_line'] = _macd_lines_kernel(close_array, int(f), int(s), int(si))
+        return result
     
     # === 新增：ATR 与 ADX 计算（Wilder算法） ===
 
     def get_symbol_cfg(self, symbol: str) -> Dict[str, float | str]:
         """返回币种配置；若未配置则使用默认"""
-        try:
-            cfg = self.symbol_cfg.get(symbol)
-            if cfg:
-                return cfg
-        except Exception:
-            pass
-        return {"period": 20, "n": 2.0, "m": 3.0, "trigger_pct": 0.010, "trail_pct": 0.006, "update_basis": "close"}
+        return self.symbol_cfg.get(symbol) or self._default_cfg
 
     def _set_initial_sl_tp(self, symbol: str, entry_price: float, atr_val: float, side: str):
         """设置初始 SL/TP：多头 SL=P-N*ATR，TP=P+M*ATR；空头 SL=P+N*ATR，TP=P-M*ATR（使用币种配置n/m）"""
-        try:
-            if atr_val <= 0 or entry_price <= 0 or side not in ('long', 'short'):
-                return
-            cfg = self.get_symbol_cfg(symbol)
-            n = float(cfg['n']); m = float(cfg['m'])
-            if side == 'long':
-                sl = entry_price - n * atr_val
-                tp = entry_price + m * atr_val
-                side_num = 1.0
-                # 初始化峰值
-                self.trailing_peak[symbol] = max(entry_price, self.trailing_peak.get(symbol, entry_price))
-            else:
-                sl = entry_price + n * atr_val
-                tp = entry_price - m * atr_val
-                side_num = -1.0
-                # 初始化谷值
-                self.trailing_trough[symbol] = min(entry_price, self.trailing_trough.get(symbol, entry_price)) if symbol in self.trailing_trough else entry_price
-            self.sl_tp_state[symbol] = {'sl': float(sl), 'tp': float(tp), 'side': side_num, 'entry': float(entry_price)}
-        except Exception:
-            pass
+        if atr_val <= 0 or entry_price <= 0 or side not in ('long', 'short'):
+            return
+        cfg = self.get_symbol_cfg(symbol)
+        n = float(cfg['n']); m = float(cfg['m'])
+        if side == 'long':
+            sl = entry_price - n * atr_val
+            tp = entry_price + m * atr_val
+            side_num = 1.0
+            # 初始化峰值
+            self.trailing_peak[symbol] = max(entry_price, self.trailing_peak.get(symbol, entry_price))
+        else:
+            sl = entry_price + n * atr_val
+            tp = entry_price - m * atr_val
+            side_num = -1.0
+            # 初始化谷值
+            self.trailing_trough[symbol] = min(entry_price, self.trailing_trough.get(symbol, entry_price)) if symbol in self.trailing_trough else entry_price
+        self.sl_tp_state[symbol] = {'sl': float(sl), 'tp': float(tp), 'side': side_num, 'entry': float(entry_price)}
 
     def _update_trailing_stop(self, symbol: str, current_price: float, atr_val: float, side: str):
         """动态移动止损（币种配置）：
@@ -1148,47 +1729,78 @@ class MACDStrategy:
         - 激活条件：价格相对入场达到 trigger_pct
         - long: SL=max(SL_old, basis-N*ATR, peak*(1-trail_pct)); short: SL=min(SL_old, basis+N*ATR, trough*(1+trail_pct))
         """
+        st = self.sl_tp_state.get(symbol)
+        if not st or atr_val <= 0 or current_price <= 0 or side not in ('long', 'short'):
+            return
+        cfg = self.get_symbol_cfg(symbol)
+        n = float(cfg['n']); trigger_pct = float(cfg['trigger_pct']); trail_pct = float(cfg['trail_pct'])
+        entry = float(st.get('entry', 0) or 0)
+        if entry <= 0:
+            return
+
+        # 选择更新基准价
+        basis_price = float(current_price)
+        # 若有当前K线最高/最低价，可在调用处传入；此处回退使用 current_price
+        if side == 'long':
+            # 更新峰值并上移止损
+            new_sl, peak = _trailing_long(float(st['sl']), entry, float(self.trailing_peak.get(symbol, entry)),
+                                          basis_price, n, float(atr_val), trigger_pct, trail_pct)
+            self.trailing_peak[symbol] = float(peak)
+        else:
+            # 更新谷值并下移止损
+            new_sl, trough = _trailing_short(float(st['sl']), entry, float(self.trailing_trough.get(symbol, entry)),
+                                             basis_price, n, float(atr_val), trigger_pct, trail_pct)
+            self.trailing_trough[symbol] = float(trough)
+        st['sl'] = float(new_sl)
+        self.sl_tp_state[symbol] = st
+    def _tp_sl_triggers(self, symbol: str, entry_price: float, side: str, atr_val: float,
+                        sl_price: Optional[float] = None, tp_price: Optional[float] = None) -> Tuple[float, float]:
+        """计算交易所侧 (sl_trigger, tp_trigger)：默认按入场价 ± N/M*ATR，传入 sl_price/tp_price（跟踪止损状态）时以其为准；
+        再按最新价方向钳制并按 tick 对齐"""
+        # 多空镜像：side_sign=+1(long)/-1(short)，SL 在入场价的逆方向，TP 在顺方向
+        n = float(self.atr_sl_n); m = float(self.atr_tp_m)
+        side_sign = 1.0 if side == 'long' else -1.0
+        sl_trigger = sl_price if sl_price else entry_price - side_sign * n * atr_val
+        tp_trigger = tp_price if tp_price else entry_price + side_sign * m * atr_val
+
+        # 钳制触发价：基于最新价方向校验，并按 tick 对齐，避免 51280 风控错误
         try:
-            st = self.sl_tp_state.get(symbol)
-            if not st or atr_val <= 0 or current_price <= 0 or side not in ('long', 'short'):
-                return
-            cfg = self.get_symbol_cfg(symbol)
-            n = float(cfg['n']); trigger_pct = float(cfg['trigger_pct']); trail_pct = float(cfg['trail_pct'])
-            entry = float(st.get('entry', 0) or 0)
-            if entry <= 0:
-                return
-
-            # 选择更新基准价
-            basis_price = float(current_price)
-            # 若有当前K线最高/最低价，可在调用处传入；此处回退使用 current_price
-            if side == 'long':
-                # 更新峰值
-                peak = max(self.trailing_peak.get(symbol, entry), basis_price)
-                self.trailing_peak[symbol] = peak
-                # 激活条件：涨幅达到 trigger_pct
-                activated = (basis_price >= entry * (1 + trigger_pct))
-                atr_sl = basis_price - n * atr_val
-                percent_sl = peak * (1 - trail_pct) if activated else st['sl']
-                new_sl = max(st['sl'], atr_sl, percent_sl)
-                if new_sl > st['sl']:
-                    st['sl'] = float(new_sl)
-            else:
-                # 更新谷值
-                trough_prev = self.trailing_trough.get(symbol, entry)
-                trough = min(trough_prev, basis_price) if trough_prev else basis_price
-                self.trailing_trough[symbol] = trough
-                # 激活条件：跌幅达到 trigger_pct（相对入场价下跌）
-                activated = (basis_price <= entry * (1 - trigger_pct))
-                atr_sl = basis_price + n * atr_val
-                percent_sl = trough * (1 + trail_pct) if activated else st['sl']
-                new_sl = min(st['sl'], atr_sl, percent_sl)
-                if new_sl < st['sl']:
-                    st['sl'] = float(new_sl)
-            self.sl_tp_state[symbol] = st
+            last_price = self._get_last_price(self.symbol_to_inst_id(symbol))
+            mi = self.markets_info.get(symbol, {})
+            tick = mi.get('tick') or 1.0 / 10 ** int(mi.get('price_precision', 4))
+            # tick 为10的幂时在整数域对齐；否则（如 0.005）按 tick 网格对齐
+            price_scale = self._pow10_scale(tick)
+            min_gap = max(0.001 * last_price, 5 * tick) if last_price > 0 else 5 * tick
+            if last_price > 0:
+                # 多头 SL < last、TP > last；空头相反（乘 side_sign 后统一为同一方向比较）
+                sl_trigger = side_sign * min(side_sign * sl_trigger, side_sign * last_price - min_gap)
+                tp_trigger = side_sign * max(side_sign * tp_trigger, side_sign * last_price + min_gap)
+                # 步进对齐（保持方向约束）：多头 SL 向下取整、TP 向上取整，空头相反
+                sl_round = (math.ceil, math.floor)[int((side_sign + 1) / 2)]
+                tp_round = (math.floor, math.ceil)[int((side_sign + 1) / 2)]
+                if price_scale:
+                    sl_trigger = sl_round(sl_trigger * price_scale) / price_scale
+                    tp_trigger = tp_round(tp_trigger * price_scale) / price_scale
+                else:
+                    sl_trigger = round(sl_round(round(sl_trigger / tick, 9)) * tick, 12)
+                    tp_trigger = round(tp_round(round(tp_trigger / tick, 9)) * tick, 12)
         except Exception:
             pass
-    def place_okx_tp_sl(self, symbol: str, entry_price: float, side: str, atr_val: float) -> bool:
-        """在OKX侧同时挂TP/SL条件单；posSide=long→side='sell'，posSide=short→side='buy'；执行价用市价(-1)"""
+        return sl_trigger, tp_trigger
+
+    def _clear_tp_sl_state(self, symbol: str):
+        """持仓已平（主动平仓/交易所侧OCO触发/反手前）时清除本地TP/SL记录：已挂标记、已挂触发价与跟踪止损状态，
+        下一笔持仓重新初始化并真正挂单"""
+        self.okx_tp_sl_placed.pop(symbol, None)
+        self._placed_tp_sl.pop(symbol, None)
+        self.sl_tp_state.pop(symbol, None)
+
+    def place_okx_tp_sl(self, symbol: str, entry_price: float, side: str, atr_val: float,
+                        pos: Optional[Dict[str, Any]] = None, cancel_existing: bool = True,
+                        sl_price: Optional[float] = None, tp_price: Optional[float] = None) -> bool:
+        """在OKX侧同时挂TP/SL条件单；posSide=long→side='sell'，posSide=short→side='buy'；执行价用市价(-1)
+        pos 为调用方刚取得的持仓时直接复用，省去一次私有接口刷新；调用方已批量撤单时传 cancel_existing=False；
+        跟踪止损重挂时传 sl_price/tp_price（sl_tp_state 中的当前值），否则按入场价与ATR计算"""
         try:
             # 已挂过则直接返回
             if self.okx_tp_sl_placed.get(symbol):
@@ -1197,58 +1809,24 @@ class MACDStrategy:
             if not inst_id or entry_price <= 0 or atr_val <= 0 or side not in ('long', 'short'):
                 return False
             # 获取当前持仓数量用于 sz（OKX要求 sz 或 closeFraction）
-            pos = self.get_position(symbol, force_refresh=True)
-            size = float(pos.get('size', 0) or 0)
+            if not pos or pos['size'] <= 0:
+                pos = self.get_position(symbol, force_refresh=True)
+            size = pos['size']
             if size <= 0:
                 logger.warning(f"⚠️ 无有效持仓数量，跳过挂TP/SL {symbol}")
                 return False
 
             # 撤销已挂的TP/SL条件单，避免重复残留
-            try:
-                self.cancel_symbol_tp_sl(symbol)
-                time.sleep(0.3)  # 节流，避免与后续下单竞态
-            except Exception:
-                pass
+            if cancel_existing:
+                try:
+                    self.cancel_symbol_tp_sl(symbol)
+                    time.sleep(0.3)  # 节流，避免与后续下单竞态
+                except Exception:
+                    pass
 
-            n = float(self.atr_sl_n); m = float(self.atr_tp_m)
-            if side == 'long':
-                sl_trigger = entry_price - n * atr_val
-                tp_trigger = entry_price + m * atr_val
-                ord_side = 'sell'
-                pos_side = 'long'
-            else:
-                sl_trigger = entry_price + n * atr_val
-                tp_trigger = entry_price - m * atr_val
-                ord_side = 'buy'
-                pos_side = 'short'
-            
-            # 钳制触发价：基于最新价方向校验，并按 tick 对齐，避免 51280 风控错误
-            try:
-                last_price = 0.0
-                tkr = self.exchange.publicGetMarketTicker({'instId': inst_id})
-                if isinstance(tkr, dict):
-                    d = tkr.get('data') or []
-                    if isinstance(d, list) and d:
-                        last_price = float(d[0].get('last') or d[0].get('lastPx') or 0.0)
-                price_prec = int(self.markets_info.get(symbol, {}).get('price_precision', 4))
-                tick = 10 ** (-price_prec)
-                min_gap = max(0.001 * last_price, 5 * tick) if last_price > 0 else 5 * tick
-                if last_price > 0:
-                    if side == 'long':
-                        # 多头：SL < last，TP > last
-                        sl_trigger = min(sl_trigger, last_price - min_gap)
-                        tp_trigger = max(tp_trigger, last_price + min_gap)
-                        # 步进对齐（保持方向约束）
-                        sl_trigger = math.floor(sl_trigger / tick) * tick
-                        tp_trigger = math.ceil(tp_trigger / tick) * tick
-                    else:
-                        # 空头：SL > last，TP < last
-                        sl_trigger = max(sl_trigger, last_price + min_gap)
-                        tp_trigger = min(tp_trigger, last_price - min_gap)
-                        sl_trigger = math.ceil(sl_trigger / tick) * tick
-                        tp_trigger = math.floor(tp_trigger / tick) * tick
-            except Exception:
-                pass
+            ord_side = self._close_side_of[side]
+            pos_side = side
+            sl_trigger, tp_trigger = self._tp_sl_triggers(symbol, entry_price, side, atr_val, sl_price, tp_price)
 
             params = {
                 'instId': inst_id,
@@ -1273,6 +1851,7 @@ class MACDStrategy:
             if ok:
                 logger.info(f"📌 交易所侧TP/SL已挂 {symbol}: size={size:.6f} TP@{tp_trigger:.6f} SL@{sl_trigger:.6f}")
                 self.okx_tp_sl_placed[symbol] = True
+                self._placed_tp_sl[symbol] = (sl_trigger, tp_trigger)
                 return True
             else:
                 logger.warning(f"⚠️ 交易所侧TP/SL挂单失败 {symbol}: {resp}")
@@ -1281,137 +1860,125 @@ class MACDStrategy:
             logger.warning(f"⚠️ 交易所侧TP/SL挂单异常 {symbol}: {e}")
             return False
 
-    def calculate_atr(self, klines: List[Dict], period: int = 14) -> float:
-        """计算 ATR（Wilder），返回最新值；klines需含 high/low/close，按时间升序"""
-        try:
-            if len(klines) < period + 1:
-                return 0.0
-            highs = np.array([k['high'] for k in klines], dtype=float)
-            lows = np.array([k['low'] for k in klines], dtype=float)
-            closes = np.array([k['close'] for k in klines], dtype=float)
-            prev_closes = np.concatenate(([closes[0]], closes[:-1]))
-            tr = np.maximum(highs - lows, np.maximum(np.abs(highs - prev_closes), np.abs(lows - prev_closes)))
-            # Wilder 平滑：先用TR的period均值作为首个ATR，再进行递推
-            atr = np.zeros_like(tr)
-            atr[period-1] = tr[:period].mean()
-            for i in range(period, len(tr)):
-                atr[i] = (atr[i-1] * (period - 1) + tr[i]) / period
-            return float(atr[-1])
-        except Exception:
+    def _hlc_arrays(self, klines: List[Dict] | Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """取 high/low/close 数组：SoA 字典直接复用，K线列表则用 np.fromiter 逐列转换（不生成中间 list）"""
+        if isinstance(klines, dict):
+            return klines['high'], klines['low'], klines['close']
+        n = len(klines)
+        highs = np.fromiter((k['high'] for k in klines), dtype=np.float64, count=n)
+        lows = np.fromiter((k['low'] for k in klines), dtype=np.float64, count=n)
+        closes = np.fromiter((k['close'] for k in klines), dtype=np.float64, count=n)
+        return highs, lows, closes
+
+    def calculate_atr(self, klines: List[Dict] | Dict[str, np.ndarray], period: int = 14,
+                      symbol: Optional[str] = None, bar_key: Any = None) -> float:
+        """计算 ATR（Wilder），返回最新值；klines为K线列表或 klines_soa 数组字典，按时间升序。
+        传入 symbol 与 bar_key 时缓存前一根的ATR状态：窗口未滚动则只对最新一根实时K线做一步递推"""
+        highs, lows, closes = self._hlc_arrays(klines)
+        period = int(period)
+        if period < 1 or len(closes) < period + 1:
             return 0.0
-
-    def calculate_adx(self, klines: List[Dict], period: int = 14) -> float:
-        """计算 ADX（Wilder），返回最新值；klines需含 high/low/close，按时间升序"""
-        try:
-            if len(klines) < period + 1:
-                return 0.0
-            highs = np.array([k['high'] for k in klines], dtype=float)
-            lows = np.array([k['low'] for k in klines], dtype=float)
-            closes = np.array([k['close'] for k in klines], dtype=float)
-
-            up_move = highs[1:] - highs[:-1]
-            down_move = lows[:-1] - lows[1:]
-            plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
-            minus_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0.0)
-
-            prev_closes = closes[:-1]
-            tr = np.maximum(highs[1:] - lows[1:], np.maximum(np.abs(highs[1:] - prev_closes), np.abs(lows[1:] - prev_closes)))
-
-            # Wilder 平滑
-            def wilder_smooth(arr):
-                sm = np.zeros_like(arr)
-                sm[period-1] = arr[:period].sum()
-                for i in range(period, len(arr)):
-                    sm[i] = sm[i-1] - (sm[i-1] / period) + arr[i]
-                return sm
-
-            plus_dm_sm = wilder_smooth(plus_dm)
-            minus_dm_sm = wilder_smooth(minus_dm)
-            tr_sm = wilder_smooth(tr)
-
-            # 避免除零
-            tr_sm_safe = np.where(tr_sm == 0, 1e-12, tr_sm)
-
-            plus_di = 100.0 * (plus_dm_sm / tr_sm_safe)
-            minus_di = 100.0 * (minus_dm_sm / tr_sm_safe)
-            dx = 100.0 * (np.abs(plus_di - minus_di) / np.maximum(plus_di + minus_di, 1e-12))
-
-            # ADX 为 DX 的 Wilder 平滑
-            adx = np.zeros_like(dx)
-            adx[period-1] = dx[:period].mean()
-            for i in range(period, len(dx)):
-                adx[i] = (adx[i-1] * (period - 1) + dx[i]) / period
-
-            return float(adx[-1])
-        except Exception:
+        if symbol is None or bar_key is None:
+            # TR 计算与 Wilder 平滑在同一个内核中完成，不再分配 TR 及中间临时数组
+            return float(_atr_kernel(highs, lows, closes, period))
+        state_key = (bar_key, period)
+        cached = self._atr_state.get(symbol)
+        if cached is not None and cached[0] == state_key:
+            atr_prev, prev_close = cached[1]
+        else:
+            atr_prev = float(_atr_kernel(highs[:-1], lows[:-1], closes[:-1], period))
+            prev_close = float(closes[-2])
+            self._atr_state[symbol] = (state_key, (atr_prev, prev_close))
+        h = float(highs[-1])
+        l = float(lows[-1])
+        tr = max(h - l, abs(h - prev_close), abs(l - prev_close))
+        return (atr_prev * (period - 1) + tr) / period
+
+    def calculate_adx(self, klines: List[Dict] | Dict[str, np.ndarray], period: int = 14,
+                      symbol: Optional[str] = None, bar_key: Any = None) -> float:
+        """计算 ADX（Wilder），返回最新值；klines为K线列表或 klines_soa 数组字典，按时间升序。
+        传入 symbol 与 bar_key 时缓存前一根的平滑状态：窗口未滚动则只对最新一根实时K线做一步递推"""
+        highs, lows, closes = self._hlc_arrays(klines)
+        period = int(period)
+        if period < 1 or len(closes) < period + 1:
             return 0.0
-
-    def analyze_symbol(self, symbol: str) -> Dict[str, str]:
-        """分析单个交易对"""
+        # 前一根之前的K线不足以完成首个ADX播种时，缓存状态无法单步递推，直接整窗计算
+        if symbol is None or bar_key is None or len(closes) < period + 2:
+            # +DM/-DM/TR 的 Wilder 平滑与 ADX 递推在同一个内核中完成
+            return float(_adx_kernel(highs, lows, closes, period))
+        state_key = (bar_key, period)
+        cached = self._adx_state.get(symbol)
+        if cached is not None and cached[0] == state_key:
+            plus_sm, minus_sm, tr_sm, adx, ph, pl, pc = cached[1]
+        else:
+            plus_sm, minus_sm, tr_sm, adx = (float(x) for x in _adx_state_kernel(highs[:-1], lows[:-1], closes[:-1], period))
+            ph, pl, pc = float(highs[-2]), float(lows[-2]), float(closes[-2])
+            self._adx_state[symbol] = (state_key, (plus_sm, minus_sm, tr_sm, adx, ph, pl, pc))
+        h = float(highs[-1])
+        l = float(lows[-1])
+        up_move = h - ph
+        down_move = pl - l
+        plus_dm = up_move if (up_move > down_move and up_move > 0) else 0.0
+        minus_dm = down_move if (down_move > up_move and down_move > 0) else 0.0
+        tr = max(h - l, abs(h - pc), abs(l - pc))
+        plus_sm = plus_sm - plus_sm / period + plus_dm
+        minus_sm = minus_sm - minus_sm / period + minus_dm
+        tr_sm = tr_sm - tr_sm / period + tr
+        tr_safe = tr_sm if tr_sm != 0 else 1e-12
+        plus_di = 100.0 * plus_sm / tr_safe
+        minus_di = 100.0 * minus_sm / tr_safe
+        dx = 100.0 * abs(plus_di - minus_di) / max(plus_di + minus_di, 1e-12)
+        return (adx * (period - 1) + dx) / period
+
+    def analyze_symbol(self, symbol: str) -> Dict[str, Any]:
+        """分析单个交易对；算出ATR后的返回值附带 ctx={'atr','close','kl'}，供止损跟踪复用"""
         try:
             # 获取K线数据
             klines = self.get_klines(symbol, 100)
             if not klines:
                 return {'signal': 'hold', 'reason': '数据获取失败'}
             
-            # 提取收盘价（包含最新正在形成的K线）
-            closes = [kline['close'] for kline in klines]
+            # 提取收盘价（包含最新正在形成的K线）；优先复用 get_klines 缓存的 SoA 数组，只转换一次
+            soa = self.klines_soa.get(symbol, klines)
+            closes = self._hlc_arrays(soa)[2]
 
             if len(closes) < 2:
                 return {'signal': 'hold', 'reason': '数据不足'}
 
             # === 先做ATR与ADX过滤 ===
-            try:
-                atr_period = int((os.environ.get('ATR_PERIOD') or '14').strip())
-            except Exception:
-                atr_period = 14
-            try:
-                atr_ratio_thresh = float((os.environ.get('ATR_RATIO_THRESH') or '0.004').strip())
-            except Exception:
-                atr_ratio_thresh = 0.004
-            try:
-                adx_period = int((os.environ.get('ADX_PERIOD') or '14').strip())
-            except Exception:
-                adx_period = 14
-            try:
-                adx_min_trend = float((os.environ.get('ADX_MIN_TREND') or '25').strip())
-            except Exception:
-                adx_min_trend = 25.0
+            atr_period = self.atr_period
+            atr_ratio_thresh = self.atr_ratio_thresh
+            adx_period = self.adx_period
+            adx_min_trend = self.adx_min_trend
 
             close_price = float(closes[-1])
-            atr_val = self.calculate_atr(klines, atr_period)
-            adx_val = self.calculate_adx(klines, adx_period)
-
-            if atr_val > 0 and close_price > 0:
+            # 窗口首/末时间与长度作为K线窗口标识，ATR 与 MACD 共用：同一根实时K线内只对最新一根递推
+            bar_key = (klines[0]['timestamp'], klines[-1]['timestamp'], len(klines))
+            atr_val = self.calculate_atr(soa, atr_period, symbol, bar_key)
+            adx_val = self.calculate_adx(soa, adx_period, symbol, bar_key)
+            ctx = {'atr': atr_val, 'close': close_price, 'kl': klines}
+
+            # ATR/ADX 软过滤仅输出提示，DEBUG 关闭时整段跳过（含 f-string 格式化）
+            debug_on = logger.isEnabledFor(logging.DEBUG)
+            if debug_on and atr_val > 0 and close_price > 0:
                 atr_ratio = atr_val / close_price
                 if atr_ratio < atr_ratio_thresh:
-                    logger.debug(f"ATR滤波提示：波动率低（ATR/收盘={atr_ratio:.4f} < {atr_ratio_thresh}），不拦截信号")
+                    logger.debug("ATR滤波提示：波动率低（ATR/收盘=%.4f < %s），不拦截信号", atr_ratio, atr_ratio_thresh)
 
-            if adx_val > 0 and adx_val < adx_min_trend:
-                logger.debug(f"ADX滤波提示：趋势不足（ADX={adx_val:.1f} < {adx_min_trend}），不拦截信号")
+            if debug_on and adx_val > 0 and adx_val < adx_min_trend:
+                logger.debug("ADX滤波提示：趋势不足（ADX=%.1f < %s），不拦截信号", adx_val, adx_min_trend)
 
             # 使用实时K线：当前与前一根（不等待收盘） - 支持分币种MACD参数
-            _p = getattr(self, 'per_symbol_params', {}).get(symbol, {})
-            _macd = _p.get('macd') if isinstance(_p, dict) else None
-            if isinstance(_macd, tuple) and len(_macd) == 3:
-                f, s, si = int(_macd[0]), int(_macd[1]), int(_macd[2])
-                macd_current = self.calculate_macd_with_params(closes, f, s, si)
-                macd_prev = self.calculate_macd_with_params(closes[:-1], f, s, si)
-            else:
-                macd_current = self.calculate_macd(closes)
-                macd_prev = self.calculate_macd(closes[:-1])
+            cfg = self._sym_cfg[symbol]
+            f, s, si = cfg.macd
+            # 单次遍历同时得到前一根与当前的MACD，不再对 closes[:-1] 重算；同一根实时K线内复用前一根状态，只递推一步
+            macd_prev, macd_current = self.calculate_macd_pair(closes, f, s, si, symbol, bar_key)
             
-            # 获取持仓（强制刷新，确保信号判断基于最新持仓）
-            position = self.get_position(symbol, force_refresh=True)
-            try:
-                logger.debug(f"📏 {symbol} ATR={atr_val:.6f}, ATR/Close={atr_val/close_price:.6f} | ADX={adx_val:.2f}")
-            except Exception:
-                pass
+            # 获取持仓：本轮已批量刷新过则读缓存，否则强制刷新，确保信号判断基于最新持仓
+            position = self.get_position(symbol, force_refresh=not self._tick_positions_fresh)
             # 可选：在日志里输出ATR/ADX，用于回溯
-            try:
-                logger.debug(f"📏 {symbol} ATR({atr_period})={atr_val:.6f}, ATR/Close={atr_val/close_price:.6f} | ADX({adx_period})={adx_val:.2f}")
-            except Exception:
-                pass
+            if debug_on and close_price > 0:
+                logger.debug("📏 %s ATR(%s)=%.6f, ATR/Close=%.6f | ADX(%s)=%.2f", symbol, atr_period, atr_val, atr_val / close_price, adx_period, adx_val)
             
             # 使用实时K线进行交叉与柱状图颜色变化判断
             prev_macd = macd_prev['macd']
@@ -1421,77 +1988,64 @@ class MACDStrategy:
             current_signal = macd_current['signal']
             current_hist = macd_current['histogram']
             
-            logger.debug(f"📊 {symbol} MACD(实时) - 当前: MACD={current_macd:.6f}, Signal={current_signal:.6f}, Hist={current_hist:.6f}")
+            if debug_on:
+                logger.debug("📊 %s MACD(实时) - 当前: MACD=%.6f, Signal=%.6f, Hist=%.6f", symbol, current_macd, current_signal, current_hist)
             
             # 分币种 ADX 硬过滤（若配置了更严格阈值，则不足直接不交易）
-            try:
-                _p2 = getattr(self, 'per_symbol_params', {}).get(symbol, {})
-                _th = float(_p2.get('adx_min_trend', 0) or 0)
-                if _th > 0 and adx_val > 0 and adx_val < _th:
-                    return {'signal': 'hold', 'reason': f'ADX不足 {adx_val:.1f} < {_th:.1f}'}
-            except Exception:
-                pass
+            _th = cfg.adx_min
+            if _th > 0 and adx_val > 0 and adx_val < _th:
+                return {'signal': 'hold', 'reason': f'ADX不足 {adx_val:.1f} < {_th:.1f}', 'ctx': ctx}
             
-            # 生成交易信号
-            if position['size'] == 0:  # 无持仓
-                # 双确认开仓：交叉 + 柱状图跨零变色（减少频繁交易）
-                buy_cross = (prev_macd <= prev_signal and current_macd > current_signal)
-                buy_color = (prev_hist <= 0 and current_hist > 0)
-                sell_cross = (prev_macd >= prev_signal and current_macd < current_signal)
-                sell_color = (prev_hist >= 0 and current_hist < 0)
-
-                if buy_cross and buy_color:
-                    return {'signal': 'buy', 'reason': '双确认：金叉 + 柱状图由负转正'}
-                elif sell_cross and sell_color:
-                    return {'signal': 'sell', 'reason': '双确认：死叉 + 柱状图由正转负'}
-                else:
-                    return {'signal': 'hold', 'reason': '等待双确认信号'}
-            
-            else:  # 有持仓
-                current_position_side = position['side']
-                
-                if current_position_side == 'long':
-                    # 多头双确认平仓：死叉且柱状图为负
-                    if (prev_macd >= prev_signal and current_macd < current_signal) and (current_hist < 0):
-                        return {'signal': 'close', 'reason': '多头双确认平仓：死叉且柱状图为负'}
-                    else:
-                        return {'signal': 'hold', 'reason': '持有多头'}
-                
-                else:  # short
-                    # 空头双确认平仓：金叉且柱状图为正
-                    if (prev_macd <= prev_signal and current_macd > current_signal) and (current_hist > 0):
-                        return {'signal': 'close', 'reason': '空头双确认平仓：金叉且柱状图为正'}
-                    else:
-                        return {'signal': 'hold', 'reason': '持有空头'}
-                        
+            # 生成交易信号：交叉/变色条件与持仓状态打包为状态码，查表得到 (signal, reason)
+            buy_cross = (prev_macd <= prev_signal and current_macd > current_signal)
+            buy_color = (prev_hist <= 0 and current_hist > 0)
+            sell_cross = (prev_macd >= prev_signal and current_macd < current_signal)
+            sell_color = (prev_hist >= 0 and current_hist < 0)
+            state = 0 if position['size'] == 0 else (1 if position['side'] == 'long' else 2)
+            code = (state << 6 | buy_cross | buy_color << 1 | sell_cross << 2 | sell_color << 3
+                    | (current_hist > 0) << 4 | (current_hist < 0) << 5)
+            signal, reason = SIGNAL_TABLE[code]
+            return {'signal': signal, 'reason': reason, 'ctx': ctx}
+
         except Exception as e:
             logger.error(f"❌ 分析{symbol}失败: {e}")
             return {'signal': 'hold', 'reason': f'分析异常: {e}'}
     
     def _throttle(self):
-        """简单节流：控制最小 API 调用间隔，保护速率限制"""
-        try:
-            now = time.time()
-            wait = self._min_api_interval - (now - self._last_api_ts)
-            if wait and wait > 0:
-                time.sleep(wait)
-            self._last_api_ts = time.time()
-        except Exception:
-            pass
+        """令牌桶节流：按单调时钟补充令牌，有令牌直接放行，不足时只等待补足一个令牌所需时间；
+        由 exchange.throttle 包装在每次 REST 请求前调用"""
+        if self._min_api_interval <= 0:
+            return
+        with self._api_lock:
+            now = time.monotonic()
+            if self._last_api_ts:
+                self._api_tokens = min(self._api_burst, self._api_tokens + (now - self._last_api_ts) * self._api_rate)
+            self._last_api_ts = now
+            if self._api_tokens < 1.0:
+                time.sleep((1.0 - self._api_tokens) / self._api_rate)
+                self._api_tokens = 0.0
+                self._last_api_ts = time.monotonic()
+            else:
+                self._api_tokens -= 1.0
 
     def execute_strategy(self):
         """执行策略"""
         logger.info("=" * 70)
-        logger.info(f"🚀 开始执行MACD策略 (分币种杠杆，{self.timeframe} 周期)")
+        logger.info("🚀 开始执行MACD策略 (分币种杠杆，%s 周期)", self.timeframe)
         logger.info("=" * 70)
         
         try:
             # 检查是否需要同步状态
             self.check_sync_needed()
             
+            # 本轮巡检编号：同一轮内 get_klines 结果复用，避免分析与止损跟踪重复拉取
+            self._tick_id = time.monotonic_ns()
+            # 本轮持仓一次批量拉取写入缓存，分析与执行阶段均读缓存，不再逐币种强制刷新两次
+            self._tick_positions_fresh = self.fetch_all_positions() is not None
+
             # 显示当前余额
             balance = self.get_account_balance()
-            logger.info(f"💰 当前账户余额: {balance:.2f} USDT")
+            logger.info("💰 当前账户余额: %.2f USDT", balance)
             
             # 显示交易统计
             logger.info(self.stats.get_summary())
@@ -1502,38 +2056,57 @@ class MACDStrategy:
             logger.info("🔍 分析交易信号...")
             logger.info("-" * 70)
             
-            # 分析所有交易对
+            # 分析所有交易对：各币种的K线/持仓/挂单请求互相独立，线程池并发以重叠网络延迟
+            # 挂单同样账户级一次拉取（失败则在各币种任务内逐个查询）
+            all_orders = self.fetch_all_open_orders()
+
+            def _analyze_one(sym: str):
+                orders = all_orders[sym] if all_orders is not None else self.get_open_orders(sym)
+                return sym, self.analyze_symbol(sym), self.get_position(sym, force_refresh=False), orders
+
             signals = {}
-            for symbol in self.symbols:
-                signals[symbol] = self.analyze_symbol(symbol)
-                position = self.get_position(symbol, force_refresh=False)
-                open_orders = self.get_open_orders(symbol)
-                
-                status_line = f"📊 {symbol}: 信号={signals[symbol]['signal']}, 原因={signals[symbol]['reason']}"
-                if open_orders:
-                    status_line += f", 挂单={len(open_orders)}个"
+            results = list(self._io_pool.map(_analyze_one, self.symbols))
+            # 汇总与日志保持原顺序串行输出
+            for symbol, signal_info, position, open_orders in results:
+                signals[symbol] = signal_info
                 
-                logger.info(status_line)
+                if logger.isEnabledFor(logging.INFO):
+                    status_line = f"📊 {symbol}: 信号={signals[symbol]['signal']}, 原因={signals[symbol]['reason']}"
+                    if open_orders:
+                        status_line += f", 挂单={len(open_orders)}个"
+                    logger.info(status_line)
             
             logger.info("-" * 70)
             logger.info("⚡ 执行交易操作...")
             logger.info("")
             
             # 执行交易
+            pending_rehang: List[Tuple[str, float, str, float]] = []  # (symbol, entry, side, atr) 待重挂TP/SL
+            # SL/TP 触发的平仓互不依赖，提交到I/O线程池并发下单，不等前一个成交再平下一个
+            exit_futures = []
             for symbol, signal_info in signals.items():
                 signal = signal_info['signal']
                 reason = signal_info['reason']
                 
-                # 获取当前持仓（强制刷新，确保动作基于最新状态）
-                current_position = self.get_position(symbol, force_refresh=True)
+                # 获取当前持仓：本轮批量刷新的缓存（下单/平仓会在轮询成交时就地更新），批量失败时才逐个强制刷新
+                current_position = self.get_position(symbol, force_refresh=not self._tick_positions_fresh)
+                # 交易所侧OCO已触发等原因持仓已平，但本地仍有TP/SL记录：清除，避免下一笔持仓沿用旧的已挂标记
+                if current_position['size'] <= 0 and symbol in self.sl_tp_state:
+                    self._clear_tp_sl_state(symbol)
                 
                 # 优先进行 SL/TP 检查与跟踪止损更新（触发则直接平仓，不反手）
                 try:
-                    kl = self.get_klines(symbol, 50)
+                    # 复用 analyze_symbol 本轮已算好的收盘价与ATR；分析提前返回时才重新取K线计算
+                    ctx = signal_info.get('ctx')
+                    if ctx:
+                        kl = ctx['kl']
+                        close_price = ctx['close']
+                        atr_val = ctx['atr']
+                    else:
+                        kl = self.get_klines(symbol, 50)
+                        close_price = float(kl[-1]['close']) if kl else 0.0
+                        atr_val = self.calculate_atr(self.klines_soa.get(symbol, kl), self.atr_period) if kl else 0.0
                     if kl:
-                        close_price = float(kl[-1]['close'])
-                        atr_p = int((os.environ.get('ATR_PERIOD') or '14').strip())
-                        atr_val = self.calculate_atr(kl, atr_p)
                         if current_position and current_position.get('size', 0) > 0 and atr_val > 0:
                             self._update_trailing_stop(symbol, close_price, atr_val, current_position.get('side', 'long'))
                             st = self.sl_tp_state.get(symbol)
@@ -1548,26 +2121,20 @@ class MACDStrategy:
                                             st['sl'] = max(st['sl'], close_price - 1.2 * atr_val) if current_position.get('side') == 'long' else min(st['sl'], close_price + 1.2 * atr_val)
                                 except Exception:
                                     pass
-                                try:
-                                    # 动态止盈收紧后，撤旧重挂交易所侧TP/SL
-                                    self.okx_tp_sl_placed[symbol] = False
-                                    self.cancel_symbol_tp_sl(symbol)
-                                    self.place_okx_tp_sl(symbol, entry_px, current_position.get('side', 'long'), atr_val)
-                                    logger.info(f"🔁 更新追踪止盈：已撤旧单并重挂 {symbol}")
-                                except Exception as _e:
-                                    logger.warning(f"⚠️ 更新追踪止盈重挂失败 {symbol}: {_e}")
                                 if current_position.get('side') == 'long':
                                     if close_price <= st['sl'] or close_price >= st['tp']:
                                         logger.info(f"⛔ 触发SL/TP多头 {symbol}: 价={close_price:.6f} SL={st['sl']:.6f} TP={st['tp']:.6f}")
-                                        self.close_position(symbol, open_reverse=False)
-                                        current_position = self.get_position(symbol, force_refresh=True)
+                                        exit_futures.append(self._io_pool.submit(self.close_position, symbol, False))
                                         continue
                                 else:  # short
                                     if close_price >= st['sl'] or close_price <= st['tp']:
                                         logger.info(f"⛔ 触发SL/TP空头 {symbol}: 价={close_price:.6f} SL={st['sl']:.6f} TP={st['tp']:.6f}")
-                                        self.close_position(symbol, open_reverse=False)
-                                        current_position = self.get_position(symbol, force_refresh=True)
+                                        exit_futures.append(self._io_pool.submit(self.close_position, symbol, False))
                                         continue
+                                # 动态止盈收紧后需撤旧重挂交易所侧TP/SL：SL 变化不足一个 tick 则跳过，变化的先入队，本轮结束后批量处理
+                                tick = self.markets_info.get(symbol, {}).get('tick') or 1e-8
+                                if abs(st['sl'] - st.get('hung_sl', -math.inf)) > tick:
+                                    pending_rehang.append((symbol, entry_px, current_position.get('side', 'long'), atr_val))
                 except Exception:
                     pass
                 
@@ -1599,18 +2166,58 @@ class MACDStrategy:
                 
                 elif signal == 'close':
                     # 平仓；是否反手按分币种策略
-                    _pp = getattr(self, 'per_symbol_params', {}).get(symbol, {})
-                    allow_reverse = bool(_pp.get('allow_reverse', True)) if isinstance(_pp, dict) else True
+                    allow_reverse = self._sym_cfg[symbol].allow_reverse
                     if self.close_position(symbol, open_reverse=allow_reverse):
                         if allow_reverse:
                             logger.info(f"✅ 平仓并反手开仓 {symbol} 成功 - {reason}")
                         else:
                             logger.info(f"✅ 平仓完成（不反手） {symbol} - {reason}")
+
+            # 等待并发平仓全部完成（持仓缓存随之更新），再处理重挂
+            for fut in exit_futures:
+                fut.result()
+
+            # 批量重挂TP/SL：一次查询+批量撤销，再逐个挂新单；本轮已平仓或方向已变的币种跳过，
+            # 按当前跟踪状态算出的触发价与已挂的一致（钳制/对齐后无变化）也跳过，避免无谓撤单留下无止损空窗
+            if pending_rehang:
+                live = []
+                for sym, entry, side, atr in pending_rehang:
+                    pos = self.positions_cache.get(sym, {})
+                    if pos.get('size', 0) <= 0 or pos.get('side') != side:
+                        continue
+                    st = self.sl_tp_state.get(sym)
+                    # 只有确认本笔持仓已挂出OCO时才按已挂触发价去重（平仓/转空仓时已清除记录）
+                    placed = self._placed_tp_sl.get(sym) if self.okx_tp_sl_placed.get(sym) else None
+                    if st and placed:
+                        triggers = self._tp_sl_triggers(sym, entry, side, atr, st['sl'], st['tp'])
+                        tick = self.markets_info.get(sym, {}).get('tick') or 1e-8
+                        if abs(triggers[0] - placed[0]) < tick / 2 and abs(triggers[1] - placed[1]) < tick / 2:
+                            st['hung_sl'] = st['sl']
+                            continue
+                    live.append((sym, entry, side, atr))
+                # 撤单失败时旧OCO可能仍在交易所侧，此时再挂会留下重复条件单：本轮不重挂，hung_sl 不变，下轮重试
+                if live and not self.cancel_tp_sl_batch([x[0] for x in live]):
+                    logger.warning("⚠️ 批量撤销TP/SL失败，本轮跳过重挂: %s", ', '.join(x[0] for x in live))
+                    live = []
+                if live:
+                    for sym, entry, side, atr in live:
+                        self.okx_tp_sl_placed[sym] = False
+                        st = self.sl_tp_state.get(sym)
+                        if self.place_okx_tp_sl(sym, entry, side, atr, self.positions_cache.get(sym), cancel_existing=False,
+                                                sl_price=st['sl'] if st else None, tp_price=st['tp'] if st else None):
+                            if st:
+                                st['hung_sl'] = st['sl']
+                            logger.info(f"🔁 更新追踪止盈：已撤旧单并重挂 {sym}")
+                        else:
+                            logger.warning(f"⚠️ 更新追踪止盈重挂失败 {sym}")
             
             logger.info("=" * 70)
                         
         except Exception as e:
             logger.error(f"❌ 执行策略失败: {e}")
+        finally:
+            self._tick_id = 0
+            self._tick_positions_fresh = False
     
     def run_continuous(self, interval: int = 60):
         """连续运行策略（改为北京时间整点刷新）"""
@@ -1628,32 +2235,46 @@ class MACDStrategy:
         logger.info(self.stats.get_summary())
         logger.info("=" * 70)
 
-        china_tz = pytz.timezone('Asia/Shanghai')
+        # K线改由WebSocket推送（不可用或超时无推送时自动回退REST）
+        self.start_kline_ws()
 
+        # 固定节拍调度：下一轮时间点按 interval 累加（单调时钟），不因取整或耗时漂移；超时的轮次直接丢弃不追赶
+        period = interval if interval > 0 else 1
+        next_tick = time.monotonic()
+        # 异常重试等待：从一个周期起指数退避（上限60秒）并加抖动，成功一轮后复位
+        retry_delay = float(period)
         while True:
             try:
-                # 实时巡检模式：每 interval 秒执行一次
-                start_ts = time.time()
-
                 # 按需同步状态（内部有节流）
                 self.check_sync_needed()
 
                 # 执行策略（含拉取行情、分析与下单）
                 self.execute_strategy()
-
-                # 计算本轮耗时与休眠
-                elapsed = time.time() - start_ts
-                sleep_sec = max(1, int(interval - elapsed)) if interval > 0 else 1
-                logger.info(f"⏳ 休眠 {sleep_sec} 秒后继续实时巡检...")
-                time.sleep(sleep_sec)
+                retry_delay = float(period)
+                # 本轮已读过最新K线，巡检期间到达的新K线事件作废
+                self._new_bar_event.clear()
+
+                next_tick += period
+                sleep_sec = next_tick - time.monotonic()
+                if sleep_sec > 0:
+                    logger.info("⏳ 休眠 %.2f 秒后继续实时巡检...", sleep_sec)
+                    # 休眠期间有新K线推送则提前唤醒立即巡检，节拍从此刻重新起算
+                    if self._new_bar_event.wait(sleep_sec):
+                        logger.info("🕯️ 新K线到达，提前巡检")
+                        next_tick = time.monotonic()
+                else:
+                    next_tick = time.monotonic()
 
             except KeyboardInterrupt:
                 logger.info("⛔ 用户中断，策略停止")
                 break
             except Exception as e:
                 logger.error(f"❌ 策略运行异常: {e}")
-                logger.info("🔄 60秒后重试...")
-                time.sleep(60)
+                wait = min(retry_delay, 60.0) * (1.0 + random.random() * 0.2)
+                logger.info("🔄 %.1f秒后重试...", wait)
+                time.sleep(wait)
+                retry_delay = min(retry_delay * 2, 60.0)
+                next_tick = time.monotonic()
 
 def main():
     """主函数"""
@@ -1681,6 +2302,12 @@ def main():
         return
     
     logger.info("✅ 环境变量检查通过")
+
+    # 预热指标内核，首个tick不再承担JIT编译耗时
+    try:
+        _warmup_kernels()
+    except Exception as e:
+        logger.warning(f"⚠️ 指标内核预热失败: {e}")
     
     # 创建策略实例
     try: